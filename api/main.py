@@ -2,13 +2,21 @@
 
 from __future__ import annotations
 
+import asyncio
+import os
+from collections.abc import Iterator
+from pathlib import Path
+
+import orjson
 from fastapi import FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 from api import queries
 from api.models import (
     ApprovalTimeline,
     ConstructionByZip,
+    DashboardResponse,
     FilterOptions,
     HousingUnits,
     OverviewResponse,
@@ -25,18 +33,32 @@ app = FastAPI(
         "Data covers 2002–present from two permitting systems (legacy + current)."
     ),
     version="0.1.0",
+    default_response_class=ORJSONResponse,
 )
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
 
+# Parquet listing for /health, rescanned only when the directory mtime changes.
+_HEALTH_CACHE: dict = {"mtime": None, "files": []}
+
+
+def _ndjson(batches: Iterator[list[dict]]) -> Iterator[bytes]:
+    """Encode row batches as newline-delimited JSON, one chunk per batch."""
+    for rows in batches:
+        yield b"".join(orjson.dumps(row) + b"\n" for row in rows)
+
+
 @app.get("/health")
 def health():
     """Debug endpoint — shows data path and file availability."""
-    from pathlib import Path
-
-    agg = Path(queries._AGG)
-    files = sorted(p.name for p in agg.glob("*.parquet")) if agg.exists() else []
-    return {"agg_path": str(agg), "exists": agg.exists(), "files": files}
+    try:
+        mtime = os.stat(queries._AGG).st_mtime
+    except FileNotFoundError:
+        return {"agg_path": queries._AGG, "exists": False, "files": []}
+    if mtime != _HEALTH_CACHE["mtime"]:
+        _HEALTH_CACHE["files"] = sorted(p.name for p in Path(queries._AGG).glob("*.parquet"))
+        _HEALTH_CACHE["mtime"] = mtime
+    return {"agg_path": queries._AGG, "exists": True, "files": _HEALTH_CACHE["files"]}
 
 
 @app.get("/")
@@ -53,82 +75,106 @@ def root():
             "/solar-permits",
             "/construction-by-zip",
             "/top-permit-types",
+            "/dashboard",
         ],
     }
 
 
 @app.get("/filters", response_model=FilterOptions)
-def filters():
+async def filters():
     """Available years, permit types, zip codes, and source systems."""
-    return queries.get_filter_options()
+    return await asyncio.to_thread(queries.get_filter_options)
 
 
 @app.get("/overview", response_model=OverviewResponse)
-def overview(
+async def overview(
     yr_min: int | None = Query(None, description="Minimum year"),
     yr_max: int | None = Query(None, description="Maximum year"),
     permit_type: str | None = Query(None, description="Filter by permit type"),
     zip_code: str | None = Query(None, description="Filter by zip code"),
 ):
     """Total permits, housing units, valuation, and median approval days."""
-    return queries.get_overview(yr_min, yr_max, permit_type, zip_code)
+    return await asyncio.to_thread(queries.get_overview, yr_min, yr_max, permit_type, zip_code)
 
 
-@app.get("/permit-volume", response_model=list[PermitVolume])
-def permit_volume(
+@app.get("/permit-volume", responses={200: {"model": list[PermitVolume]}})
+async def permit_volume(
     yr_min: int | None = Query(None),
     yr_max: int | None = Query(None),
     permit_type: str | None = Query(None),
     zip_code: str | None = Query(None),
+    stream: bool = Query(False, description="Stream rows as NDJSON"),
 ):
     """Monthly permit counts by type."""
-    return queries.get_permit_volume(yr_min, yr_max, permit_type, zip_code)
+    if stream:
+        return StreamingResponse(
+            _ndjson(queries.stream_permit_volume(yr_min, yr_max, permit_type, zip_code)),
+            media_type="application/x-ndjson",
+        )
+    return await asyncio.to_thread(queries.get_permit_volume, yr_min, yr_max, permit_type, zip_code)
 
 
 @app.get("/housing-units", response_model=list[HousingUnits])
-def housing_units(
+async def housing_units(
     yr_min: int | None = Query(None),
     yr_max: int | None = Query(None),
 ):
     """Annual dwelling units by income category (for RHNA tracking)."""
-    return queries.get_housing_units(yr_min, yr_max)
+    return await asyncio.to_thread(queries.get_housing_units, yr_min, yr_max)
 
 
-@app.get("/approval-timelines", response_model=list[ApprovalTimeline])
-def approval_timelines(
+@app.get("/approval-timelines", responses={200: {"model": list[ApprovalTimeline]}})
+async def approval_timelines(
     yr_min: int | None = Query(None),
     yr_max: int | None = Query(None),
     permit_type: str | None = Query(None),
     zip_code: str | None = Query(None),
+    stream: bool = Query(False, description="Stream rows as NDJSON"),
 ):
     """Approval day statistics by type and zip code."""
-    return queries.get_approval_timelines(yr_min, yr_max, permit_type, zip_code)
+    if stream:
+        return StreamingResponse(
+            _ndjson(queries.stream_approval_timelines(yr_min, yr_max, permit_type, zip_code)),
+            media_type="application/x-ndjson",
+        )
+    return await asyncio.to_thread(queries.get_approval_timelines, yr_min, yr_max, permit_type, zip_code)
 
 
 @app.get("/solar-permits", response_model=list[SolarPermit])
-def solar_permits(
+async def solar_permits(
     yr_min: int | None = Query(None),
     yr_max: int | None = Query(None),
     zip_code: str | None = Query(None),
 ):
     """Monthly solar permit counts with cumulative totals."""
-    return queries.get_solar_permits(yr_min, yr_max, zip_code)
+    return await asyncio.to_thread(queries.get_solar_permits, yr_min, yr_max, zip_code)
 
 
-@app.get("/construction-by-zip", response_model=list[ConstructionByZip])
-def construction_by_zip(
+@app.get("/construction-by-zip", responses={200: {"model": list[ConstructionByZip]}})
+async def construction_by_zip(
     yr_min: int | None = Query(None),
     yr_max: int | None = Query(None),
     zip_code: str | None = Query(None),
 ):
     """Permits, valuation, and dwelling units by zip code and year."""
-    return queries.get_construction_by_zip(yr_min, yr_max, zip_code)
+    return await asyncio.to_thread(queries.get_construction_by_zip, yr_min, yr_max, zip_code)
 
 
 @app.get("/top-permit-types", response_model=list[PermitTypeSummary])
-def top_permit_types(
+async def top_permit_types(
     yr_min: int | None = Query(None),
     yr_max: int | None = Query(None),
 ):
     """Summary stats per permit type."""
-    return queries.get_top_permit_types(yr_min, yr_max)
+    return await asyncio.to_thread(queries.get_top_permit_types, yr_min, yr_max)
+
+
+@app.get("/dashboard", response_model=DashboardResponse)
+async def dashboard(
+    yr_min: int | None = Query(None, description="Minimum year"),
+    yr_max: int | None = Query(None, description="Maximum year"),
+    permit_type: str | None = Query(None, description="Filter overview by permit type"),
+    zip_code: str | None = Query(None, description="Filter overview by zip code"),
+):
+    """Overview stats and per-type summary in one call (single scan)."""
+    return await asyncio.to_thread(queries.get_overview_and_top_types, yr_min, yr_max, permit_type, zip_code)
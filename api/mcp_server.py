@@ -99,7 +99,8 @@ def get_solar_permits(
 ) -> list[dict]:
     """Get monthly solar/PV permit counts with cumulative totals.
 
-    Returns year, month, zip_code, permit_count, cumulative_total.
+    Returns year, month, zip_code, permit_count, cumulative_total
+    (running total within each zip_code).
     """
     return queries.get_solar_permits(yr_min, yr_max, zip_code)
 
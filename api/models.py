@@ -69,3 +69,8 @@ class PermitTypeSummary(BaseModel):
     permit_count: int
     avg_valuation: int | None
     median_approval_days: int | None
+
+
+class DashboardResponse(BaseModel):
+    overview: OverviewResponse
+    top_permit_types: list[PermitTypeSummary]
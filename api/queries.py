@@ -1,11 +1,18 @@
 """Shared query layer — all SQL lives here.
 
 Used by the Streamlit dashboard, FastAPI app, and MCP server.
-Each function creates a fresh DuckDB connection, queries parquets, returns list[dict].
+All functions share one in-memory DuckDB connection (a cursor per call),
+query parquets, and return list[dict].
 """
 
 from __future__ import annotations
 
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
 from pathlib import Path
 
 import duckdb
@@ -13,6 +20,120 @@ import duckdb
 _ROOT = Path(__file__).resolve().parent.parent
 _AGG = str(_ROOT / "data" / "aggregated")
 
+# One connection per process; each query runs on its own cursor so concurrent
+# requests are safe while sharing DuckDB's buffer manager and metadata caches.
+_CON = duckdb.connect(database=":memory:")
+# Keep decoded parquet footers/row-group stats resident between requests.
+_CON.execute("SET parquet_metadata_cache = true")
+# Pin parallelism to the cores this process sees and cap memory so a
+# uvicorn worker or MCP subprocess can't OOM its container.
+_CON.execute(f"SET threads = {os.cpu_count() or 1}")
+_CON.execute("SET memory_limit = '2GB'")
+
+# Aggregated parquets the API reads, registered as views by file stem (and
+# re-registered when the aggregates are rebuilt, see _agg_mtime).
+# Queries reference the view names, so the only path interpolation left is
+# this DDL (DuckDB can't bind parameters in CREATE VIEW) — quote it safely.
+_TABLES = (
+    "permit_summary",
+    "permit_volume_monthly",
+    "housing_units_by_year",
+    "approval_timelines",
+    "solar_permits_monthly",
+    "construction_by_zip",
+    "top_permit_types",
+    "top_permit_types_precomputed",
+)
+# Re-stat the aggregated parquets at most this often (seconds); cache hits in
+# between reuse the last sentinel instead of globbing the directory.
+_AGG_CHECK_INTERVAL = 5.0
+_AGG_STATE: dict = {"mtime": None, "checked": float("-inf")}
+_AGG_LOCK = threading.Lock()
+# Views whose parquet carries the per-day approval histogram (exact medians).
+_HIST_TABLES: frozenset[str] = frozenset()
+
+
+def _register_views() -> frozenset[str]:
+    """(Re)create a view per aggregated parquet; return the names carrying histograms."""
+    for name in _TABLES:
+        path = Path(_AGG) / f"{name}.parquet"
+        if path.exists():
+            sql_path = str(path).replace("'", "''")
+            _CON.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM read_parquet('{sql_path}')")
+    return frozenset(
+        r[0]
+        for r in _CON.execute(
+            "SELECT table_name FROM information_schema.columns WHERE column_name = 'approval_days_hist'"
+        ).fetchall()
+    )
+
+
+def _agg_mtime() -> float:
+    """Latest modification time across the aggregated parquets (cache sentinel).
+
+    Re-checked at most every ``_AGG_CHECK_INTERVAL`` seconds. When it moves, the
+    views and ``_HIST_TABLES`` are refreshed so a rebuild that adds a parquet or
+    changes its schema is picked up without a restart.
+    """
+    global _HIST_TABLES
+    now = time.monotonic()
+    with _AGG_LOCK:
+        if now - _AGG_STATE["checked"] < _AGG_CHECK_INTERVAL:
+            return _AGG_STATE["mtime"]
+        mtime = max((p.stat().st_mtime for p in Path(_AGG).glob("*.parquet")), default=0.0)
+        if _AGG_STATE["mtime"] != mtime:
+            _HIST_TABLES = _register_views()
+            _AGG_STATE["mtime"] = mtime
+        _AGG_STATE["checked"] = now
+        return mtime
+
+
+_agg_mtime()
+
+
+def _copy(result):
+    """Copy the dicts/lists of a cached result so callers can't mutate the entry."""
+    if isinstance(result, dict):
+        return {k: _copy(v) for k, v in result.items()}
+    if isinstance(result, list):
+        return [_copy(v) for v in result]
+    return result
+
+
+def _cached(ttl: float = 60.0, maxsize: int = 256):
+    """Memoize a query function by its args for ``ttl`` seconds (LRU-bounded).
+
+    Entries are also dropped when an aggregated parquet is rebuilt. Each call
+    gets its own copy of the cached result.
+    """
+
+    def decorator(fn):
+        cache: OrderedDict = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            mtime = _agg_mtime()
+            with lock:
+                hit = cache.get(key)
+                if hit is not None and hit[0] == mtime and now - hit[1] < ttl:
+                    cache.move_to_end(key)
+                    return _copy(hit[2])
+            result = fn(*args, **kwargs)
+            with lock:
+                cache[key] = (mtime, now, result)
+                cache.move_to_end(key)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return _copy(result)
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
 
 def _where(
     yr_min: int | None = None,
@@ -28,55 +149,126 @@ def _where(
     has_type: bool = True,
     has_zip: bool = True,
     has_source: bool = False,
-) -> str:
-    """Build a WHERE clause from optional filter params."""
-    clauses: list[str] = []
-    if yr_min is not None:
-        clauses.append(f"{year_col} >= {int(yr_min)}")
-    if yr_max is not None:
-        clauses.append(f"{year_col} <= {int(yr_max)}")
-    if permit_type and has_type:
-        clauses.append(f"{type_col} = '{permit_type.replace(chr(39), chr(39)*2)}'")
-    if zip_code and has_zip:
-        clauses.append(f"{zip_col} = '{zip_code.replace(chr(39), chr(39)*2)}'")
-    if source_system and has_source and source_col:
-        clauses.append(f"{source_col} = '{source_system.replace(chr(39), chr(39)*2)}'")
-    return ("WHERE " + " AND ".join(clauses)) if clauses else ""
-
-
-def _q(sql: str) -> list[dict]:
-    """Execute SQL and return list of row dicts."""
-    con = duckdb.connect()
-    df = con.execute(sql).fetchdf()
-    con.close()
-    return df.to_dict(orient="records")
+) -> tuple[str, list]:
+    """Build a parameterized WHERE clause from optional filter params.
+
+    Returns (clause, params) for ``con.execute(sql, params)``.
+    """
+    if yr_min is None and yr_max is None and not (permit_type or zip_code or source_system):
+        return "", []
+    filters = (
+        (year_col, ">=", None if yr_min is None else int(yr_min)),
+        (year_col, "<=", None if yr_max is None else int(yr_max)),
+        (type_col, "=", permit_type if has_type else None),
+        (zip_col, "=", zip_code if has_zip else None),
+        (source_col, "=", source_system if has_source and source_col else None),
+    )
+    active = [(col, op, val) for col, op, val in filters if val is not None and val != ""]
+    if not active:
+        return "", []
+    clause = "WHERE " + " AND ".join(f"{col} {op} ?" for col, op, _ in active)
+    return clause, [val for _, _, val in active]
+
+
+def _median_days(table: str, src: str, keys: str = "") -> tuple[str, str]:
+    """Return (select expr, join clause) for median_approval_days over rows of ``src``.
+
+    When ``table`` has approval_days_hist, the histograms are merged and the exact
+    median taken. Otherwise falls back to the count-weighted mean of group medians
+    (parquets built before the histogram column existed).
+    """
+    _agg_mtime()  # refreshes _HIST_TABLES if the aggregates were rebuilt
+    if table not in _HIST_TABLES:
+        return (
+            "CAST(SUM(median_approval_days * count_with_days)"
+            " / NULLIF(SUM(count_with_days), 0) AS INTEGER)",
+            "",
+        )
+    sel = f"{keys}, " if keys else ""
+    part = f"PARTITION BY {keys}" if keys else ""
+    med = f"""
+        SELECT {sel}CAST((MIN(days) FILTER (WHERE cum >= (tot + 1) // 2)
+                        + MIN(days) FILTER (WHERE cum >= tot // 2 + 1)) / 2 AS INTEGER)
+               AS median_approval_days
+        FROM (
+            SELECT {sel}days,
+                   SUM(n) OVER ({part} ORDER BY days) AS cum,
+                   SUM(n) OVER ({part}) AS tot
+            FROM (
+                SELECT {sel}days, SUM(n) AS n
+                FROM (SELECT {sel}UNNEST(approval_days_hist, recursive := true) FROM {src})
+                GROUP BY {sel}days
+            )
+        )
+        {f"GROUP BY {keys}" if keys else ""}
+    """
+    join = f"LEFT JOIN ({med}) med USING ({keys})" if keys else f"CROSS JOIN ({med}) med"
+    return "ANY_VALUE(med.median_approval_days)", join
+
+
+def _q(sql: str, params: list | None = None) -> list[dict]:
+    """Execute SQL with bound params and return list of row dicts."""
+    con = _CON.cursor()
+    try:
+        return con.execute(sql, params or []).fetch_arrow_table().to_pylist()
+    finally:
+        con.close()
+
+
+def _q_stream(sql: str, params: list | None = None, batch_size: int = 10_000) -> Iterator[list[dict]]:
+    """Execute SQL and yield row dicts in Arrow record-batch sized chunks."""
+    con = _CON.cursor()
+    try:
+        reader = con.execute(sql, params or []).fetch_record_batch(batch_size)
+        for batch in reader:
+            yield batch.to_pylist()
+    finally:
+        con.close()
+
+
+def _q_one(sql: str, params: list | None = None) -> dict:
+    """Execute SQL expected to return a single row; return it as a dict."""
+    con = _CON.cursor()
+    try:
+        row = con.execute(sql, params or []).fetchone()
+        cols = [d[0] for d in con.description]
+    finally:
+        con.close()
+    return dict(zip(cols, row)) if row else {}
 
 
 # ── 1. Filter options ──
 
 
+_FILTER_CACHE: dict = {"mtime": None, "options": None}
+
+
 def get_filter_options() -> dict:
-    """Return available filter values: years, permit types, zip codes, source systems."""
-    con = duckdb.connect()
-    years = sorted(
-        r[0]
-        for r in con.execute(
-            f"SELECT DISTINCT year FROM '{_AGG}/permit_volume_monthly.parquet' WHERE year IS NOT NULL ORDER BY year"
-        ).fetchall()
-    )
-    types = sorted(
-        r[0]
-        for r in con.execute(
-            f"SELECT DISTINCT approval_type_clean FROM '{_AGG}/top_permit_types.parquet' ORDER BY 1"
-        ).fetchall()
-    )
-    zips = sorted(
-        r[0]
-        for r in con.execute(
-            f"SELECT DISTINCT zip_code FROM '{_AGG}/construction_by_zip.parquet' WHERE zip_code IS NOT NULL ORDER BY 1"
-        ).fetchall()
-    )
-    con.close()
+    """Return available filter values: years, permit types, zip codes, source systems.
+
+    Computed once and reused until an aggregated parquet is rebuilt.
+    """
+    mtime = _agg_mtime()
+    if _FILTER_CACHE["mtime"] != mtime:
+        _FILTER_CACHE["options"] = _load_filter_options()
+        _FILTER_CACHE["mtime"] = mtime
+    return _copy(_FILTER_CACHE["options"])
+
+
+def _load_filter_options() -> dict:
+    con = _CON.cursor()
+    try:
+        years = con.execute(
+            "SELECT DISTINCT year FROM permit_volume_monthly WHERE year IS NOT NULL ORDER BY year"
+        ).fetch_arrow_table().column(0).to_pylist()
+        types = con.execute(
+            "SELECT DISTINCT approval_type_clean FROM top_permit_types ORDER BY 1"
+        ).fetch_arrow_table().column(0).to_pylist()
+        zips = con.execute(
+            "SELECT DISTINCT zip_code FROM construction_by_zip WHERE zip_code IS NOT NULL ORDER BY 1"
+        ).fetch_arrow_table().column(0).to_pylist()
+    finally:
+        con.close()
     return {
         "years": years,
         "permit_types": types,
@@ -88,6 +280,7 @@ def get_filter_options() -> dict:
 # ── 2. Overview ──
 
 
+@_cached()
 def get_overview(
     yr_min: int | None = None,
     yr_max: int | None = None,
@@ -95,23 +288,39 @@ def get_overview(
     zip_code: str | None = None,
 ) -> dict:
     """Total permits, DUs, valuation, and median approval days."""
-    w = _where(yr_min, yr_max, permit_type, zip_code)
-    rows = _q(f"""
+    w, params = _where(yr_min, yr_max, permit_type, zip_code)
+    med, med_join = _median_days("permit_summary", "filtered")
+    return _q_one(f"""
+        WITH filtered AS (
+            SELECT * FROM permit_summary
+            {w}
+        )
         SELECT
-            SUM(permit_count) AS total_permits,
+            SUM(permit_count)::BIGINT AS total_permits,
             SUM(total_du) AS total_du,
             SUM(total_valuation)::BIGINT AS total_valuation,
-            CAST(SUM(median_approval_days * count_with_days)
-                 / NULLIF(SUM(count_with_days), 0) AS INTEGER) AS median_approval_days
-        FROM '{_AGG}/permit_summary.parquet'
-        {w}
-    """)
-    return rows[0] if rows else {}
+            {med} AS median_approval_days
+        FROM filtered
+        {med_join}
+    """, params)
 
 
 # ── 3. Permit volume ──
 
 
+def _permit_volume_sql(yr_min, yr_max, permit_type, zip_code) -> tuple[str, list]:
+    w, params = _where(yr_min, yr_max, permit_type, zip_code, has_zip=False)
+    return f"""
+        SELECT year, month, approval_type_clean,
+               SUM(permit_count)::BIGINT AS permit_count
+        FROM permit_volume_monthly
+        {w}
+        GROUP BY year, month, approval_type_clean
+        ORDER BY year, month
+    """, params
+
+
+@_cached()
 def get_permit_volume(
     yr_min: int | None = None,
     yr_max: int | None = None,
@@ -119,36 +328,53 @@ def get_permit_volume(
     zip_code: str | None = None,
 ) -> list[dict]:
     """Monthly permit counts by type."""
-    w = _where(yr_min, yr_max, permit_type, zip_code, has_zip=False)
-    return _q(f"""
-        SELECT year, month, approval_type_clean,
-               SUM(permit_count) AS permit_count
-        FROM '{_AGG}/permit_volume_monthly.parquet'
-        {w}
-        GROUP BY year, month, approval_type_clean
-        ORDER BY year, month
-    """)
+    return _q(*_permit_volume_sql(yr_min, yr_max, permit_type, zip_code))
+
+
+def stream_permit_volume(
+    yr_min: int | None = None,
+    yr_max: int | None = None,
+    permit_type: str | None = None,
+    zip_code: str | None = None,
+) -> Iterator[list[dict]]:
+    """Same rows as get_permit_volume(), yielded in batches (uncached)."""
+    return _q_stream(*_permit_volume_sql(yr_min, yr_max, permit_type, zip_code))
 
 
 # ── 4. Housing units ──
 
 
+@_cached()
 def get_housing_units(
     yr_min: int | None = None,
     yr_max: int | None = None,
 ) -> list[dict]:
     """Annual dwelling units by income category (for RHNA tracking)."""
-    w = _where(yr_min, yr_max)
+    w, params = _where(yr_min, yr_max)
     return _q(f"""
-        SELECT * FROM '{_AGG}/housing_units_by_year.parquet'
+        SELECT year, du_extremely_low, du_very_low, du_low, du_moderate,
+               du_above_moderate, adu_total, jadu_total, total_du
+        FROM housing_units_by_year
         {w}
         ORDER BY year
-    """)
+    """, params)
 
 
 # ── 5. Approval timelines ──
 
 
+def _approval_timelines_sql(yr_min, yr_max, permit_type, zip_code) -> tuple[str, list]:
+    w, params = _where(yr_min, yr_max, permit_type, zip_code)
+    return f"""
+        SELECT year, approval_type_clean, zip_code,
+               permit_count, median_days, avg_days, p90_days
+        FROM approval_timelines
+        {w}
+        ORDER BY year, approval_type_clean
+    """, params
+
+
+@_cached()
 def get_approval_timelines(
     yr_min: int | None = None,
     yr_max: int | None = None,
@@ -156,70 +382,153 @@ def get_approval_timelines(
     zip_code: str | None = None,
 ) -> list[dict]:
     """Median/avg/p90 approval days by type and zip."""
-    w = _where(yr_min, yr_max, permit_type, zip_code)
-    return _q(f"""
-        SELECT year, approval_type_clean, zip_code,
-               permit_count, median_days, avg_days, p90_days
-        FROM '{_AGG}/approval_timelines.parquet'
-        {w}
-        ORDER BY year, approval_type_clean
-    """)
+    return _q(*_approval_timelines_sql(yr_min, yr_max, permit_type, zip_code))
+
+
+def stream_approval_timelines(
+    yr_min: int | None = None,
+    yr_max: int | None = None,
+    permit_type: str | None = None,
+    zip_code: str | None = None,
+) -> Iterator[list[dict]]:
+    """Same rows as get_approval_timelines(), yielded in batches (uncached)."""
+    return _q_stream(*_approval_timelines_sql(yr_min, yr_max, permit_type, zip_code))
 
 
 # ── 6. Solar permits ──
 
 
+@_cached()
 def get_solar_permits(
     yr_min: int | None = None,
     yr_max: int | None = None,
     zip_code: str | None = None,
 ) -> list[dict]:
     """Monthly solar permit counts with cumulative totals."""
-    w = _where(yr_min, yr_max, zip_code=zip_code, has_type=False)
+    w, params = _where(yr_min, yr_max, zip_code=zip_code, has_type=False)
     return _q(f"""
         SELECT year, month, zip_code, permit_count, cumulative_total
-        FROM '{_AGG}/solar_permits_monthly.parquet'
+        FROM solar_permits_monthly
         {w}
         ORDER BY year, month
-    """)
+    """, params)
 
 
 # ── 7. Construction by zip ──
 
 
+@_cached()
 def get_construction_by_zip(
     yr_min: int | None = None,
     yr_max: int | None = None,
     zip_code: str | None = None,
 ) -> list[dict]:
     """Permit count, total valuation, total DUs by zip code and year."""
-    w = _where(yr_min, yr_max, zip_code=zip_code, has_type=False)
+    w, params = _where(yr_min, yr_max, zip_code=zip_code, has_type=False)
     return _q(f"""
-        SELECT zip_code, year, permit_count, total_valuation, total_du
-        FROM '{_AGG}/construction_by_zip.parquet'
+        SELECT zip_code, year, permit_count, total_valuation, total_du::BIGINT AS total_du
+        FROM construction_by_zip
         {w}
         ORDER BY zip_code, year
-    """)
+    """, params)
 
 
 # ── 8. Top permit types ──
 
 
+@_cached()
 def get_top_permit_types(
     yr_min: int | None = None,
     yr_max: int | None = None,
 ) -> list[dict]:
     """Summary stats per permit type: count, avg valuation, median approval days."""
-    w = _where(yr_min, yr_max, has_type=False, has_zip=False)
+    w, params = _where(yr_min, yr_max, has_type=False, has_zip=False)
+    med, med_join = _median_days("top_permit_types_precomputed", "filtered", "approval_type_clean")
     return _q(f"""
+        WITH filtered AS (
+            SELECT * FROM top_permit_types_precomputed
+            {w}
+        )
         SELECT
             approval_type_clean,
-            SUM(permit_count) AS permit_count,
+            SUM(permit_count)::BIGINT AS permit_count,
             (SUM(total_valuation) / NULLIF(SUM(permit_count), 0))::BIGINT AS avg_valuation,
-            CAST(SUM(median_approval_days * count_with_days)
-                 / NULLIF(SUM(count_with_days), 0) AS INTEGER) AS median_approval_days
-        FROM '{_AGG}/permit_summary.parquet'
-        {w}
+            {med} AS median_approval_days
+        FROM filtered
+        {med_join}
         GROUP BY approval_type_clean
         ORDER BY permit_count DESC
-    """)
+    """, params)
+
+
+# ── 9. Dashboard (overview + top permit types) ──
+
+
+@_cached()
+def get_overview_and_top_types(
+    yr_min: int | None = None,
+    yr_max: int | None = None,
+    permit_type: str | None = None,
+    zip_code: str | None = None,
+) -> dict:
+    """Overview stats and per-type summary from a single scan of permit_summary.
+
+    The year filter applies to both; permit_type/zip_code narrow only the overview,
+    matching get_overview() and get_top_permit_types().
+    """
+    w_yr, yr_params = _where(yr_min, yr_max, has_type=False, has_zip=False)
+    w_ov, ov_params = _where(permit_type=permit_type, zip_code=zip_code)
+    med_ov, join_ov = _median_days("permit_summary", "ov_rows")
+    med_top, join_top = _median_days("permit_summary", "filtered", "approval_type_clean")
+    rows = _q(f"""
+        WITH filtered AS (
+            SELECT * FROM permit_summary
+            {w_yr}
+        ),
+        ov_rows AS (
+            SELECT * FROM filtered
+            {w_ov}
+        )
+        SELECT
+            'overview' AS section,
+            NULL AS approval_type_clean,
+            SUM(permit_count)::BIGINT AS permit_count,
+            SUM(total_du) AS total_du,
+            SUM(total_valuation)::BIGINT AS total_valuation,
+            NULL::BIGINT AS avg_valuation,
+            {med_ov} AS median_approval_days
+        FROM ov_rows
+        {join_ov}
+        UNION ALL
+        SELECT
+            'top_types' AS section,
+            approval_type_clean,
+            SUM(permit_count)::BIGINT AS permit_count,
+            NULL AS total_du,
+            NULL AS total_valuation,
+            (SUM(total_valuation) / NULLIF(SUM(permit_count), 0))::BIGINT AS avg_valuation,
+            {med_top} AS median_approval_days
+        FROM filtered
+        {join_top}
+        GROUP BY approval_type_clean
+        ORDER BY section, permit_count DESC
+    """, yr_params + ov_params)
+    ov = rows[0] if rows and rows[0]["section"] == "overview" else {}
+    return {
+        "overview": {
+            "total_permits": ov.get("permit_count"),
+            "total_du": ov.get("total_du"),
+            "total_valuation": ov.get("total_valuation"),
+            "median_approval_days": ov.get("median_approval_days"),
+        },
+        "top_permit_types": [
+            {
+                "approval_type_clean": r["approval_type_clean"],
+                "permit_count": r["permit_count"],
+                "avg_valuation": r["avg_valuation"],
+                "median_approval_days": r["median_approval_days"],
+            }
+            for r in rows
+            if r["section"] == "top_types"
+        ],
+    }
@@ -2,12 +2,21 @@
 
 from __future__ import annotations
 
+import base64
+import io
+import os
+from functools import lru_cache
 from pathlib import Path
 
 import duckdb
+import numpy as np
+import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import pyarrow as pa
+import pydeck as pdk
 import streamlit as st
+from PIL import Image
 
 st.set_page_config(
     page_title="SD Housing Permits",
@@ -18,16 +27,77 @@ st.set_page_config(
 _ROOT = Path(__file__).resolve().parent.parent
 _AGG = str(_ROOT / "data" / "aggregated")
 
+RHNA_TARGET = 108_036  # 6th cycle RHNA allocation for City of San Diego
+_RHNA_GAUGE_MAX = RHNA_TARGET * 1.2
+
 
 # ── Helpers ──────────────────────────────────────────────────
 
 
-def query(sql: str):
-    """Run SQL against parquet files and return a pandas DataFrame."""
-    con = duckdb.connect()
-    return con.execute(sql).fetchdf()
+# Sort order applied when loading each aggregate, so DuckDB's zone maps can
+# prune row groups on the year / zip filters every tab applies.
+_TABLE_ORDER = {
+    "permit_volume_monthly": "year, month",
+    "housing_units_by_year": "year",
+    "approval_timelines": "year, zip_code",
+    "solar_permits_monthly": "year, month",
+    "map_points": "approval_year, zip_code",
+    "construction_by_zip": "year, zip_code",
+    "bc_code_summary": "year",
+    "permit_summary": "year, zip_code",
+    "top_permit_types_precomputed": "year",
+}
+
+
+@st.cache_resource
+def _con() -> duckdb.DuckDBPyConnection:
+    """Shared DuckDB connection with every aggregated parquet loaded as a native table.
+
+    Native tables carry zone maps and HyperLogLog stats that parquet lacks; the
+    aggregates are small enough (~12MB on disk) to load once per process.
+    """
+    con = duckdb.connect(":memory:")
+    # Pin parallelism to the cores this container sees and cap memory below
+    # the host's limit; the loaded tables count against it.
+    con.execute(f"SET threads = {os.cpu_count() or 1}")
+    con.execute("SET memory_limit = '2GB'")
+    for path in sorted(Path(_AGG).glob("*.parquet")):
+        order = _TABLE_ORDER.get(path.stem)
+        con.execute(f"""
+            CREATE OR REPLACE TABLE {path.stem} AS
+            SELECT * FROM read_parquet('{path}')
+            {f"ORDER BY {order}" if order else ""}
+        """)
+    # Set only after loading so the sorted inserts keep their order; every
+    # dashboard query that cares about row order has its own ORDER BY.
+    con.execute("SET preserve_insertion_order = false")
+    return con
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def query(sql: str, params: list | tuple = ()):
+    """Run SQL with bound params against the aggregated tables; return a DataFrame.
 
+    Memoized on (sql, params), so reruns with unchanged filters skip DuckDB entirely.
+    """
+    cur = _con().cursor()
+    try:
+        return cur.execute(sql, list(params)).fetchdf()
+    finally:
+        cur.close()
 
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def query_arrow(sql: str, params: list | tuple = ()) -> pa.Table:
+    """Like ``query()`` but return the Arrow table DuckDB produces, skipping pandas."""
+    cur = _con().cursor()
+    try:
+        return cur.execute(sql, list(params)).fetch_arrow_table()
+    finally:
+        cur.close()
+
+
+@lru_cache(maxsize=512)
 def _fmt_number(n: float, prefix: str = "") -> str:
     """Format large numbers for display."""
     if abs(n) >= 1_000_000_000:
@@ -39,6 +109,16 @@ def _fmt_number(n: float, prefix: str = "") -> str:
     return f"{prefix}{n:,.0f}"
 
 
+_MAP_PX = 1024  # Side length of the rasterized permit map, in pixels
+
+
+def _png_data_url(img: np.ndarray) -> str:
+    """Encode an RGBA array as a PNG data URL for a pydeck BitmapLayer."""
+    buf = io.BytesIO()
+    Image.fromarray(img, "RGBA").save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+
+
 # ── Sidebar ──────────────────────────────────────────────────
 
 st.sidebar.title("Filters")
@@ -46,19 +126,8 @@ st.sidebar.title("Filters")
 
 @st.cache_data(ttl=3600)
 def _sidebar_options():
-    years = sorted(
-        query(f"SELECT DISTINCT year FROM '{_AGG}/permit_volume_monthly.parquet' WHERE year IS NOT NULL")
-        ["year"].dropna().astype(int).tolist()
-    )
-    types = sorted(
-        query(f"SELECT DISTINCT approval_type_clean FROM '{_AGG}/top_permit_types.parquet'")
-        ["approval_type_clean"].tolist()
-    )
-    zips = sorted(
-        query(f"SELECT DISTINCT CAST(zip_code AS VARCHAR) AS zip_code FROM '{_AGG}/construction_by_zip.parquet' WHERE zip_code IS NOT NULL ORDER BY zip_code")
-        ["zip_code"].astype(str).tolist()
-    )
-    return years, types, zips
+    opts = query_arrow("SELECT years, types, zips FROM sidebar_options")
+    return opts["years"][0].as_py(), opts["types"][0].as_py(), opts["zips"][0].as_py()
 
 
 all_years, all_types, all_zips = _sidebar_options()
@@ -120,18 +189,23 @@ def _where(
     has_type: bool = True,
     has_zip: bool = True,
     has_source: bool = False,
-) -> str:
-    """Build WHERE clause from sidebar filter selections."""
-    clauses = [f"{year_col} BETWEEN {year_range[0]} AND {year_range[1]}"]
+) -> tuple[str, list]:
+    """Build a parameterized WHERE clause from sidebar filter selections.
+
+    Returns (clause, params) for ``query(sql, params)``.
+    """
+    clauses = [f"{year_col} BETWEEN ? AND ?"]
+    params: list = [year_range[0], year_range[1]]
     if selected_types and has_type:
-        escaped = ", ".join(f"'{t}'" for t in selected_types)
-        clauses.append(f"{type_col} IN ({escaped})")
+        clauses.append(f"{type_col} = ANY(?)")
+        params.append(list(selected_types))
     if selected_zips and has_zip:
-        escaped = ", ".join(f"'{z}'" for z in selected_zips)
-        clauses.append(f"{zip_col} IN ({escaped})")
+        clauses.append(f"{zip_col} = ANY(?)")
+        params.append(list(selected_zips))
     if _selected_source and has_source and source_col:
-        clauses.append(f"{source_col} = '{_selected_source}'")
-    return "WHERE " + " AND ".join(clauses)
+        clauses.append(f"{source_col} = ?")
+        params.append(_selected_source)
+    return "WHERE " + " AND ".join(clauses), params
 
 
 # ── Title ────────────────────────────────────────────────────
@@ -150,7 +224,7 @@ tab_overview, tab_housing, tab_map, tab_timelines, tab_solar = st.tabs(
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 with tab_overview:
-    w = _where(
+    w, params = _where(
         source_col="source_system",
         has_source=True,
     )
@@ -161,9 +235,9 @@ with tab_overview:
             SUM(total_valuation)::BIGINT AS total_valuation,
             CAST(SUM(median_approval_days * count_with_days)
                  / NULLIF(SUM(count_with_days), 0) AS INTEGER) AS median_days
-        FROM '{_AGG}/permit_summary.parquet'
+        FROM permit_summary
         {w}
-    """)
+    """, params)
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Total Permits", _fmt_number(overview["total_permits"].iloc[0]))
@@ -172,18 +246,41 @@ with tab_overview:
     md = overview["median_days"].iloc[0]
     c4.metric("Median Approval Days", f"{int(md)}" if md and md == md else "N/A")
 
+    # Volume and top types share one filtered scan of permit_volume_monthly;
+    # the source filter applies to the volume section only.
+    w_top, p_top = _where(has_zip=False)
+    w_src, p_src = ("WHERE source_system = ?", [_selected_source]) if _selected_source else ("", [])
+    vol_top = query_arrow(f"""
+        WITH filtered AS (
+            SELECT year, month, approval_type_clean, source_system, permit_count
+            FROM permit_volume_monthly
+            {w_top}
+        ),
+        top AS (
+            SELECT approval_type_clean, SUM(permit_count)::BIGINT AS permits
+            FROM filtered
+            GROUP BY approval_type_clean
+            ORDER BY permits DESC
+            LIMIT 10
+        )
+        SELECT 'volume' AS section, make_date(year, month, 1) AS date, approval_type_clean,
+               SUM(permit_count)::BIGINT AS permits
+        FROM filtered
+        {w_src}
+        GROUP BY date, approval_type_clean
+        UNION ALL
+        SELECT 'top_types', NULL, approval_type_clean, permits
+        FROM top
+        ORDER BY section, date, permits DESC
+    """, [*p_top, *p_src]).to_pandas(types_mapper=pd.ArrowDtype)
+    vol = vol_top[vol_top["section"] == "volume"].drop(columns="section")
+    top_types = (
+        vol_top[vol_top["section"] == "top_types"][["approval_type_clean", "permits"]]
+        .rename(columns={"permits": "total"})
+    )
+
     st.subheader("Permit Volume Over Time")
-    w_vol = _where(has_zip=False, source_col="source_system", has_source=True)
-    vol = query(f"""
-        SELECT year, month, approval_type_clean,
-               SUM(permit_count) AS permits
-        FROM '{_AGG}/permit_volume_monthly.parquet'
-        {w_vol}
-        GROUP BY year, month, approval_type_clean
-        ORDER BY year, month
-    """)
     if not vol.empty:
-        vol["date"] = vol.apply(lambda r: f"{int(r['year'])}-{int(r['month']):02d}-01", axis=1)
         fig_vol = px.line(
             vol,
             x="date",
@@ -198,15 +295,6 @@ with tab_overview:
 
     with col_left:
         st.subheader("Top 10 Permit Types")
-        w_top = _where(has_zip=False)
-        top_types = query(f"""
-            SELECT approval_type_clean, SUM(permit_count) AS total
-            FROM '{_AGG}/permit_volume_monthly.parquet'
-            {w_top}
-            GROUP BY approval_type_clean
-            ORDER BY total DESC
-            LIMIT 10
-        """)
         if not top_types.empty:
             fig_top = px.bar(
                 top_types,
@@ -220,7 +308,7 @@ with tab_overview:
 
     with col_right:
         st.subheader("Permits by Building Code")
-        w_bc = _where(
+        w_bc, p_bc = _where(
             has_type=False,
             has_zip=False,
             source_col="source_system",
@@ -229,12 +317,12 @@ with tab_overview:
         bc = query(f"""
             SELECT bc_code_description AS description,
                    SUM(permit_count) AS total
-            FROM '{_AGG}/bc_code_summary.parquet'
+            FROM bc_code_summary
             {w_bc}
             GROUP BY bc_code_description
             ORDER BY total DESC
             LIMIT 10
-        """)
+        """, p_bc)
         if not bc.empty:
             fig_bc = px.bar(
                 bc,
@@ -251,8 +339,6 @@ with tab_overview:
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 with tab_housing:
-    RHNA_TARGET = 108_036  # 6th cycle RHNA allocation for City of San Diego
-
     with st.expander("What is RHNA? How do I read this tab?", expanded=False):
         st.markdown("""
 **RHNA** (Regional Housing Needs Assessment) is a state-mandated process that
@@ -282,14 +368,15 @@ income categories:
 built or occupied yet. Actual construction typically follows 1–3 years later.*
 """)
 
-    hu = query(f"""
-        SELECT * FROM '{_AGG}/housing_units_by_year.parquet'
-        WHERE year BETWEEN {year_range[0]} AND {year_range[1]}
+    hu = query("""
+        SELECT *, SUM(total_du) OVER ()::BIGINT AS cumulative_du
+        FROM housing_units_by_year
+        WHERE year BETWEEN ? AND ?
         ORDER BY year
-    """)
+    """, year_range)
 
     # RHNA progress gauge
-    cumulative_du = int(hu["total_du"].sum()) if not hu.empty else 0
+    cumulative_du = int(hu["cumulative_du"].iloc[0]) if not hu.empty else 0
     pct = cumulative_du / RHNA_TARGET * 100
 
     st.subheader("RHNA Progress")
@@ -304,7 +391,7 @@ built or occupied yet. Actual construction typically follows 1–3 years later.*
         delta={"reference": RHNA_TARGET},
         title={"text": "Permitted DUs vs RHNA Target"},
         gauge={
-            "axis": {"range": [0, RHNA_TARGET * 1.2]},
+            "axis": {"range": [0, _RHNA_GAUGE_MAX]},
             "bar": {"color": "#1f77b4"},
             "steps": [
                 {"range": [0, RHNA_TARGET], "color": "#e8e8e8"},
@@ -326,22 +413,18 @@ built or occupied yet. Actual construction typically follows 1–3 years later.*
             "du_extremely_low", "du_very_low", "du_low",
             "du_moderate", "du_above_moderate",
         ]
-        fig_income = go.Figure()
-        colors = ["#d62728", "#ff7f0e", "#ffbb78", "#2ca02c", "#1f77b4"]
-        for col, color in zip(income_cols, colors):
-            label = col.replace("du_", "").replace("_", " ").title()
-            fig_income.add_trace(go.Scatter(
-                x=hu["year"],
-                y=hu[col],
-                mode="lines",
-                stackgroup="one",
-                name=label,
-                line=dict(color=color),
-            ))
+        income_labels = {col: col.replace("du_", "").replace("_", " ").title() for col in income_cols}
+        fig_income = px.area(
+            hu.rename(columns=income_labels),
+            x="year",
+            y=list(income_labels.values()),
+            color_discrete_sequence=["#d62728", "#ff7f0e", "#ffbb78", "#2ca02c", "#1f77b4"],
+        )
         fig_income.update_layout(
             height=400,
+            xaxis_title=None,
             yaxis_title="Dwelling Units",
-            legend=dict(orientation="h", y=-0.2),
+            legend=dict(orientation="h", y=-0.2, title=None),
         )
         st.plotly_chart(fig_income, use_container_width=True)
 
@@ -350,14 +433,17 @@ built or occupied yet. Actual construction typically follows 1–3 years later.*
     with col_left:
         st.subheader("ADU / JADU Trend")
         if not hu.empty:
-            fig_adu = go.Figure()
-            fig_adu.add_trace(go.Bar(x=hu["year"], y=hu["adu_total"], name="ADU"))
-            fig_adu.add_trace(go.Bar(x=hu["year"], y=hu["jadu_total"], name="JADU"))
+            fig_adu = px.bar(
+                hu.rename(columns={"adu_total": "ADU", "jadu_total": "JADU"}),
+                x="year",
+                y=["ADU", "JADU"],
+            )
             fig_adu.update_layout(
                 barmode="stack",
                 height=350,
+                xaxis_title=None,
                 yaxis_title="Units",
-                legend=dict(orientation="h", y=-0.2),
+                legend=dict(orientation="h", y=-0.2, title=None),
             )
             st.plotly_chart(fig_adu, use_container_width=True)
 
@@ -373,17 +459,17 @@ built or occupied yet. Actual construction typically follows 1–3 years later.*
 
     # Top zip codes by housing production
     st.subheader("Top Zip Codes by Housing Production")
-    w_zip = _where(has_type=False)
+    w_zip, p_zip = _where(has_type=False)
     top_zips = query(f"""
         SELECT CAST(zip_code AS VARCHAR) AS zip_code, SUM(total_du) AS total_du
-        FROM '{_AGG}/construction_by_zip.parquet'
+        FROM construction_by_zip
         {w_zip}
         AND zip_code IS NOT NULL
         GROUP BY zip_code
         HAVING SUM(total_du) > 0
         ORDER BY total_du DESC
         LIMIT 15
-    """)
+    """, p_zip)
     if not top_zips.empty:
         st.dataframe(top_zips, use_container_width=True, hide_index=True)
 
@@ -393,13 +479,11 @@ built or occupied yet. Actual construction typically follows 1–3 years later.*
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 with tab_map:
-    import pydeck as pdk
-
     st.subheader("Permit Locations")
     st.caption(
-        "Showing up to 200K sampled points. The map is most useful when you "
-        "filter by **Permit Type** in the sidebar (e.g. just \"Building Permit\" "
-        "or \"Solar/PV\") to reduce visual clutter."
+        "Every matching permit, rasterized to a 1024px density image. The map "
+        "is most useful when you filter by **Permit Type** in the sidebar (e.g. "
+        "just \"Building Permit\" or \"Solar/PV\") to reduce visual clutter."
     )
 
     color_by = st.radio(
@@ -409,57 +493,80 @@ with tab_map:
         key="map_color",
     )
 
-    w_map = _where(
+    type_colors = {
+        "Building Permit": [31, 119, 180],
+        "Solar/PV": [255, 127, 14],
+        "Electrical": [44, 160, 44],
+        "Plumbing": [214, 39, 40],
+        "Mechanical": [148, 103, 189],
+        "Fire": [140, 86, 75],
+        "Right of Way": [227, 119, 194],
+        "Sign": [127, 127, 127],
+        "Other": [188, 189, 34],
+    }
+
+    # Points are binned into pixels in SQL and colored per pixel: by the most
+    # common permit type, or by mean valuation against the 95th percentile.
+    if color_by == "Permit Type":
+        color_cols = ",\n".join(
+            "CASE approval_type_clean "
+            + " ".join(f"WHEN '{t}' THEN {c[i]}" for t, c in type_colors.items())
+            + f" ELSE {type_colors['Other'][i]} END::UTINYINT AS color_{ch}"
+            for i, ch in enumerate("rgb")
+        )
+    else:
+        color_cols = """
+            TRUNC(norm * 255)::UTINYINT AS color_r,
+            TRUNC((1 - norm) * 200)::UTINYINT AS color_g,
+            50::UTINYINT AS color_b
+        """
+
+    # One fixed grid over the full map extent, so filters never shift the pixels
+    west, east, south, north = query("""
+        SELECT MIN(lng)::DOUBLE, MAX(lng)::DOUBLE, MIN(lat)::DOUBLE, MAX(lat)::DOUBLE
+        FROM map_points
+    """).iloc[0]
+
+    w_map, p_map = _where(
         year_col="approval_year",
         zip_col="zip_code",
     )
-    map_df = query(f"""
-        SELECT lat, lng, approval_type_clean, approval_year, valuation, total_du,
-               is_housing, is_solar, zip_code
-        FROM '{_AGG}/map_points.parquet'
-        {w_map}
-        USING SAMPLE 200000
-    """)
-
-    if not map_df.empty:
-        type_colors = {
-            "Building Permit": [31, 119, 180],
-            "Solar/PV": [255, 127, 14],
-            "Electrical": [44, 160, 44],
-            "Plumbing": [214, 39, 40],
-            "Mechanical": [148, 103, 189],
-            "Fire": [140, 86, 75],
-            "Right of Way": [227, 119, 194],
-            "Sign": [127, 127, 127],
-            "Other": [188, 189, 34],
-        }
-
-        if color_by == "Permit Type":
-            map_df["color_r"] = map_df["approval_type_clean"].map(lambda t: type_colors.get(t, [188, 189, 34])[0])
-            map_df["color_g"] = map_df["approval_type_clean"].map(lambda t: type_colors.get(t, [188, 189, 34])[1])
-            map_df["color_b"] = map_df["approval_type_clean"].map(lambda t: type_colors.get(t, [188, 189, 34])[2])
-        else:
-            map_df["valuation"] = map_df["valuation"].fillna(0)
-            max_val = max(map_df["valuation"].quantile(0.95), 1)
-            norm = (map_df["valuation"] / max_val).clip(0, 1)
-            map_df["color_r"] = (norm * 255).astype(int)
-            map_df["color_g"] = ((1 - norm) * 200).astype(int)
-            map_df["color_b"] = 50
+    map_px = query_arrow(f"""
+        WITH pixels AS (
+            SELECT
+                LEAST(FLOOR((lng - ?) / ? * {_MAP_PX}), {_MAP_PX - 1})::USMALLINT AS px,
+                LEAST(FLOOR((? - lat) / ? * {_MAP_PX}), {_MAP_PX - 1})::USMALLINT AS py,
+                COUNT(*) AS n,
+                MODE(approval_type_clean) AS approval_type_clean,
+                AVG(COALESCE(valuation, 0)) AS valuation
+            FROM map_points
+            {w_map}
+            GROUP BY px, py
+        ),
+        scaled AS (
+            SELECT *,
+                   LEAST(valuation / GREATEST(QUANTILE_CONT(valuation, 0.95) OVER (), 1), 1) AS norm,
+                   COALESCE(80 + 175 * LN(n) / NULLIF(LN(MAX(n) OVER ()), 0), 255)::UTINYINT AS alpha
+            FROM pixels
+        )
+        SELECT px, py, {color_cols}, alpha
+        FROM scaled
+    """, [west, max(east - west, 1e-9), north, max(north - south, 1e-9), *p_map])
+
+    if map_px.num_rows:
+        img = np.zeros((_MAP_PX, _MAP_PX, 4), dtype=np.uint8)
+        img[map_px["py"].to_numpy(), map_px["px"].to_numpy()] = np.column_stack(
+            [map_px[c].to_numpy() for c in ("color_r", "color_g", "color_b", "alpha")]
+        )
 
         layer = pdk.Layer(
-            "ScatterplotLayer",
-            data=map_df,
-            get_position=["lng", "lat"],
-            get_color=["color_r", "color_g", "color_b", 160],
-            get_radius=50,
-            pickable=True,
+            "BitmapLayer",
+            data=None,
+            image=_png_data_url(img),
+            bounds=[west, south, east, north],
         )
         view = pdk.ViewState(latitude=32.75, longitude=-117.15, zoom=10, pitch=0)
-        deck = pdk.Deck(
-            layers=[layer],
-            initial_view_state=view,
-            tooltip={"text": "{approval_type_clean}\nYear: {approval_year}\nVal: ${valuation}\nDU: {total_du}"},
-        )
+        deck = pdk.Deck(layers=[layer], initial_view_state=view)
         st.pydeck_chart(deck)
 
         # Legend for permit type colors
@@ -474,19 +581,19 @@ with tab_map:
 
     # Construction by zip code
     st.subheader("Construction Activity by Zip Code")
-    w_cbz = _where(has_type=False)
+    w_cbz, p_cbz = _where(has_type=False)
     cbz = query(f"""
         SELECT CAST(zip_code AS VARCHAR) AS zip_code,
                SUM(permit_count) AS permits,
                SUM(total_valuation) AS valuation,
                SUM(total_du) AS du
-        FROM '{_AGG}/construction_by_zip.parquet'
+        FROM construction_by_zip
         {w_cbz}
         AND zip_code IS NOT NULL
         GROUP BY zip_code
         ORDER BY permits DESC
         LIMIT 20
-    """)
+    """, p_cbz)
     if not cbz.empty:
         fig_cbz = px.bar(
             cbz,
@@ -505,16 +612,16 @@ with tab_map:
 
 with tab_timelines:
     st.subheader("Median Approval Days by Permit Type")
-    w_tl = _where(has_zip=False)
+    w_tl, p_tl = _where(has_zip=False)
     by_type = query(f"""
         SELECT approval_type_clean,
                SUM(permit_count) AS total_permits,
                CAST(SUM(median_days * permit_count) / NULLIF(SUM(permit_count), 0) AS INTEGER) AS weighted_median_days
-        FROM '{_AGG}/approval_timelines.parquet'
+        FROM approval_timelines
         {w_tl}
         GROUP BY approval_type_clean
-        ORDER BY weighted_median_days DESC
-    """)
+        ORDER BY weighted_median_days DESC, approval_type_clean
+    """, p_tl)
     if not by_type.empty:
         fig_tl_type = px.bar(
             by_type,
@@ -529,15 +636,15 @@ with tab_timelines:
 
     # Timeline trend over time
     st.subheader("Approval Timeline Trend")
-    w_trend = _where(has_zip=False)
+    w_trend, p_trend = _where(has_zip=False)
     trend = query(f"""
         SELECT year,
                CAST(SUM(median_days * permit_count) / NULLIF(SUM(permit_count), 0) AS INTEGER) AS weighted_median_days
-        FROM '{_AGG}/approval_timelines.parquet'
+        FROM approval_timelines
         {w_trend}
         GROUP BY year
         ORDER BY year
-    """)
+    """, p_trend)
     if not trend.empty:
         fig_trend = px.line(
             trend,
@@ -551,18 +658,18 @@ with tab_timelines:
 
     # Slowest vs fastest zip codes
     st.subheader("Slowest vs Fastest Zip Codes")
-    w_zip_tl = _where(has_type=False)
+    w_zip_tl, p_zip_tl = _where(has_type=False)
     by_zip = query(f"""
         SELECT CAST(zip_code AS VARCHAR) AS zip_code,
                SUM(permit_count) AS total_permits,
                CAST(SUM(median_days * permit_count) / NULLIF(SUM(permit_count), 0) AS INTEGER) AS weighted_median_days
-        FROM '{_AGG}/approval_timelines.parquet'
+        FROM approval_timelines
         {w_zip_tl}
         AND zip_code IS NOT NULL
         GROUP BY zip_code
         HAVING SUM(permit_count) >= 100
-        ORDER BY weighted_median_days DESC
-    """)
+        ORDER BY weighted_median_days DESC, zip_code
+    """, p_zip_tl)
 
     if not by_zip.empty:
         col_slow, col_fast = st.columns(2)
@@ -602,20 +709,17 @@ with tab_timelines:
 with tab_solar:
     # Cumulative solar permits
     st.subheader("Cumulative Solar Permits")
-    solar_monthly = query(f"""
-        SELECT year, month,
-               SUM(permit_count) AS permits
-        FROM '{_AGG}/solar_permits_monthly.parquet'
-        WHERE year BETWEEN {year_range[0]} AND {year_range[1]}
-        {'AND zip_code IN (' + ','.join(f"'{z}'" for z in selected_zips) + ')' if selected_zips else ''}
-        GROUP BY year, month
-        ORDER BY year, month
-    """)
+    w_sm, p_sm = _where(has_type=False)
+    solar_monthly = query_arrow(f"""
+        SELECT make_date(year, month, 1) AS date,
+               SUM(permit_count)::BIGINT AS permits,
+               SUM(SUM(permit_count)) OVER (ORDER BY date)::BIGINT AS cumulative
+        FROM solar_permits_monthly
+        {w_sm}
+        GROUP BY date
+        ORDER BY date
+    """, p_sm).to_pandas(types_mapper=pd.ArrowDtype)
     if not solar_monthly.empty:
-        solar_monthly["date"] = solar_monthly.apply(
-            lambda r: f"{int(r['year'])}-{int(r['month']):02d}-01", axis=1
-        )
-        solar_monthly["cumulative"] = solar_monthly["permits"].cumsum()
         fig_cum = px.line(
             solar_monthly,
             x="date",
@@ -629,15 +733,15 @@ with tab_solar:
 
     with col_left:
         st.subheader("Solar Permits by Zip Code")
-        solar_zip = query(f"""
+        solar_zip = query("""
             SELECT CAST(zip_code AS VARCHAR) AS zip_code, SUM(permit_count) AS permits
-            FROM '{_AGG}/solar_permits_monthly.parquet'
-            WHERE year BETWEEN {year_range[0]} AND {year_range[1]}
+            FROM solar_permits_monthly
+            WHERE year BETWEEN ? AND ?
             AND zip_code IS NOT NULL
             GROUP BY zip_code
             ORDER BY permits DESC
             LIMIT 15
-        """)
+        """, year_range)
         if not solar_zip.empty:
             fig_sz = px.bar(
                 solar_zip,
@@ -662,27 +766,18 @@ with tab_solar:
 
     # Solar as % of all permits
     st.subheader("Solar as % of All Permits")
-    solar_pct = query(f"""
-        WITH all_permits AS (
-            SELECT year, SUM(permit_count) AS total
-            FROM '{_AGG}/permit_volume_monthly.parquet'
-            WHERE year BETWEEN {year_range[0]} AND {year_range[1]}
-            GROUP BY year
-        ),
-        solar AS (
-            SELECT year, SUM(permit_count) AS solar_total
-            FROM '{_AGG}/solar_permits_monthly.parquet'
-            WHERE year BETWEEN {year_range[0]} AND {year_range[1]}
-            GROUP BY year
-        )
-        SELECT a.year,
-               COALESCE(s.solar_total, 0) AS solar_total,
-               a.total,
-               ROUND(COALESCE(s.solar_total, 0) * 100.0 / NULLIF(a.total, 0), 1) AS solar_pct
-        FROM all_permits a
-        LEFT JOIN solar s ON a.year = s.year
-        ORDER BY a.year
-    """)
+    # approval_type_clean = 'Solar/PV' is the same predicate as the pipeline's is_solar
+    solar_pct = query("""
+        SELECT year,
+               COALESCE(SUM(permit_count) FILTER (WHERE approval_type_clean = 'Solar/PV'), 0) AS solar_total,
+               SUM(permit_count) AS total,
+               ROUND(COALESCE(SUM(permit_count) FILTER (WHERE approval_type_clean = 'Solar/PV'), 0) * 100.0
+                     / NULLIF(SUM(permit_count), 0), 1) AS solar_pct
+        FROM permit_volume_monthly
+        WHERE year BETWEEN ? AND ?
+        GROUP BY year
+        ORDER BY year
+    """, year_range)
     if not solar_pct.empty:
         fig_pct = px.line(
             solar_pct,
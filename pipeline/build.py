@@ -11,6 +11,7 @@ from pipeline.transform import transform
 
 def main() -> None:
     force = "--force" in sys.argv
+    refetch = "--refetch" in sys.argv
     t0 = time.time()
 
     print("=" * 60)
@@ -18,11 +19,11 @@ def main() -> None:
     print("=" * 60)
 
     print("\n── Step 1: Ingest ──")
-    paths = ingest(force=force)
+    paths = ingest(force=force, refetch=refetch)
     print(f"  {len(paths)} files ready\n")
 
     print("── Step 2: Transform ──")
-    transform()
+    transform(force=force)
 
     elapsed = time.time() - t0
     print(f"\nPipeline complete in {elapsed:.1f}s")
@@ -2,6 +2,9 @@
 
 from __future__ import annotations
 
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import httpx
@@ -17,30 +20,76 @@ SOURCES: dict[str, str] = {
 }
 
 
-def download(name: str, url: str, *, force: bool = False) -> Path:
-    """Download a single CSV. Skips if file exists and force=False."""
+def download(name: str, url: str, *, force: bool = False, refetch: bool = False) -> Path:
+    """Download a single CSV. Skips if file exists and force=False.
+
+    With force=True the request is conditional on the ETag / Last-Modified saved
+    from the previous download, so an unchanged file costs a 304, not a transfer.
+    The saved validators are ignored (full GET) when the CSV on disk is empty or
+    not the size that was downloaded, or with refetch=True.
+    Bytes stream to a ``.part`` file that replaces the CSV only once complete.
+    """
     dest = RAW_DIR / f"{name}.csv"
-    if dest.exists() and not force:
+    meta_path = dest.with_suffix(".meta.json")
+    if dest.exists() and not (force or refetch):
         print(f"  [skip] {name} (already exists, {dest.stat().st_size:,} bytes)")
         return dest
 
+    # identity encoding so iter_raw() yields the CSV bytes as-is
+    headers = {"Accept-Encoding": "identity"}
+    size = dest.stat().st_size if dest.exists() else 0
+    if size and meta_path.exists() and not refetch:
+        meta = json.loads(meta_path.read_text())
+        if meta.get("size") == size:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
     print(f"  [download] {name} ...")
-    with httpx.stream("GET", url, follow_redirects=True, timeout=300) as r:
-        r.raise_for_status()
-        with open(dest, "wb") as f:
-            for chunk in r.iter_bytes(chunk_size=1 << 20):
-                f.write(chunk)
-    print(f"  [done] {name} -> {dest.stat().st_size:,} bytes")
+    part = dest.with_suffix(".csv.part")
+    try:
+        with httpx.stream("GET", url, headers=headers, follow_redirects=True, timeout=300) as r:
+            if r.status_code == 304:
+                print(f"  [skip] {name} (unchanged on server)")
+                return dest
+            r.raise_for_status()
+            # A server that ignores identity still gets its body decoded
+            encoding = r.headers.get("Content-Encoding", "identity").lower()
+            raw = encoding == "identity"
+            chunks = r.iter_raw(chunk_size=1 << 20) if raw else r.iter_bytes(chunk_size=1 << 20)
+            with open(part, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            expected = r.headers.get("Content-Length")
+            if raw and expected is not None and part.stat().st_size != int(expected):
+                raise RuntimeError(
+                    f"{name}: received {part.stat().st_size:,} of {int(expected):,} bytes"
+                )
+            meta = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    os.replace(part, dest)
+    meta["size"] = dest.stat().st_size
+    meta_path.write_text(json.dumps(meta))
+    print(f"  [done] {name} -> {meta['size']:,} bytes")
     return dest
 
 
-def ingest(*, force: bool = False) -> list[Path]:
-    """Download all source CSVs. Returns list of downloaded file paths."""
+def ingest(*, force: bool = False, refetch: bool = False) -> list[Path]:
+    """Download all source CSVs. Returns list of downloaded file paths.
+
+    refetch=True re-downloads everything unconditionally (see download()).
+    """
     RAW_DIR.mkdir(parents=True, exist_ok=True)
+    # Downloads are network-bound, so run them all at once
+    with ThreadPoolExecutor(max_workers=len(SOURCES)) as pool:
+        futures = {name: pool.submit(download, name, url, force=force, refetch=refetch) for name, url in SOURCES.items()}
     paths = []
-    for name, url in SOURCES.items():
+    for name, future in futures.items():
         try:
-            paths.append(download(name, url, force=force))
+            paths.append(future.result())
         except httpx.HTTPStatusError as e:
             if e.response.status_code == 403:
                 print(f"  [warn] {name}: 403 forbidden, skipping")
@@ -2,6 +2,9 @@
 
 from __future__ import annotations
 
+import hashlib
+import os
+import shutil
 from pathlib import Path
 
 import duckdb
@@ -17,183 +20,284 @@ _SET1_CLOSED = str(_RAW / "set1_closed.csv")
 _SET2_ACTIVE = str(_RAW / "set2_active.csv")
 _SET2_CLOSED = str(_RAW / "set2_closed.csv")
 
-_PERMITS_PARQUET = str(_PROCESSED / "permits.parquet")
-
-
-def transform() -> None:
-    """Run the full transform pipeline."""
+# Raw CSV column → permits column, one row each:
+# (CSV column, permits column, kind, sets carrying it). kind "id" is taken as
+# read and "text" is TRIMmed — both are read as VARCHAR by the CSV reader
+# itself, so none is sniffed as a number only to be cast back; any other kind
+# is the SQL type the column is TRY_CAST to. Date / numeric columns stay
+# undeclared to the reader since a declared type that fails to parse would make
+# ignore_errors drop the whole row. A column one set lacks is NULL-filled by
+# the UNION ALL BY NAME.
+_CSV_COLUMNS = (
+    ("APPROVAL_ID", "approval_id", "id", (1, 2)),
+    ("PROJECT_ID", "project_id", "id", (1, 2)),
+    ("DEVELOPMENT_ID", "development_id", "id", (1,)),
+    ("PROJECT_TYPE", "project_type", "text", (1,)),
+    ("PROJECT_STATUS", "project_status", "text", (1,)),
+    ("PROJECT_PROCESSING_CODE", "project_processing_code", "text", (1, 2)),
+    ("PROJECT_TITLE", "project_title", "text", (1, 2)),
+    ("PROJECT_SCOPE", "project_scope", "text", (1, 2)),
+    ("DATE_PROJECT_CREATE", "date_project_create", "DATE", (1, 2)),
+    ("DATE_PROJECT_COMPLETE", "date_project_complete", "DATE", (1, 2)),
+    ("JOB_ID", "job_id", "id", (1, 2)),
+    ("ADDRESS_JOB", "address", "text", (1, 2)),
+    ("JOB_APN", "apn", "text", (1, 2)),
+    ("JOB_BC_CODE", "bc_code", "text", (1, 2)),
+    ("JOB_BC_CODE_DESCRIPTION", "bc_code_description", "text", (1, 2)),
+    ("LAT_JOB", "lat", "DOUBLE", (1, 2)),
+    ("LNG_JOB", "lng", "DOUBLE", (1, 2)),
+    ("APPROVAL_TYPE", "approval_type", "text", (1, 2)),
+    ("APPROVAL_STATUS", "approval_status", "text", (1, 2)),
+    ("APPROVAL_SCOPE", "approval_scope", "text", (1, 2)),
+    ("DATE_APPROVAL_CREATE", "date_approval_create", "DATE", (1, 2)),
+    ("DATE_APPROVAL_ISSUE", "date_approval_issue", "DATE", (1, 2)),
+    ("DATE_APPROVAL_EXPIRE", "date_approval_expire", "DATE", (1, 2)),
+    ("DATE_APPROVAL_CLOSE", "date_approval_close", "DATE", (1, 2)),
+    ("APPROVAL_VALUATION", "valuation", "DOUBLE", (1, 2)),
+    ("APPROVAL_DU_NET_CHANGE", "du_net_change", "INTEGER", (1,)),
+    ("APPROVAL_STORIES", "stories", "INTEGER", (1, 2)),
+    ("APPROVAL_FLOOR_AREA", "floor_area", "DOUBLE", (1, 2)),
+    ("APPROVAL_DU_EXTREMELY_LOW", "du_extremely_low", "INTEGER", (1, 2)),
+    ("APPROVAL_DU_VERY_LOW", "du_very_low", "INTEGER", (1, 2)),
+    ("APPROVAL_DU_LOW", "du_low", "INTEGER", (1, 2)),
+    ("APPROVAL_DU_MODERATE", "du_moderate", "INTEGER", (1, 2)),
+    ("APPROVAL_DU_ABOVE_MODERATE", "du_above_moderate", "INTEGER", (1, 2)),
+    ("APPROVAL_DU_FUTURE_DEMO", "du_future_demo", "INTEGER", (1, 2)),
+    ("APPROVAL_DU_BONUS", "du_bonus", "INTEGER", (1, 2)),
+    ("APPROVAL_ADU_EXTREMELY_LOW", "adu_extremely_low", "INTEGER", (2,)),
+    ("APPROVAL_ADU_VERY_LOW", "adu_very_low", "INTEGER", (2,)),
+    ("APPROVAL_ADU_LOW", "adu_low", "INTEGER", (2,)),
+    ("APPROVAL_ADU_MODERATE", "adu_moderate", "INTEGER", (2,)),
+    ("APPROVAL_ADU_ABOVE_MODERATE", "adu_above_moderate", "INTEGER", (2,)),
+    ("APPROVAL_ADU_BONUS", "adu_bonus", "INTEGER", (2,)),
+    ("APPROVAL_ADU_TOTAL", "adu_total", "INTEGER", (2,)),
+    ("APPROVAL_JADU_EXTREMELY_LOW", "jadu_extremely_low", "INTEGER", (2,)),
+    ("APPROVAL_JADU_VERY_LOW", "jadu_very_low", "INTEGER", (2,)),
+    ("APPROVAL_JADU_LOW", "jadu_low", "INTEGER", (2,)),
+    ("APPROVAL_JADU_MODERATE", "jadu_moderate", "INTEGER", (2,)),
+    ("APPROVAL_JADU_ABOVE_MODERATE", "jadu_above_moderate", "INTEGER", (2,)),
+    ("APPROVAL_JADU_BONUS", "jadu_bonus", "INTEGER", (2,)),
+    ("APPROVAL_JADU_TOTAL", "jadu_total", "INTEGER", (2,)),
+    ("APPROVAL_PERMIT_HOLDER", "permit_holder", "text", (1, 2)),
+)
+
+# Set to a directory to write a JSON query profile per aggregation step
+_PROFILE_ENV = "PERMITS_PROFILE_DIR"
+# Set to re-check after the build that dedup kept each approval's latest record
+_CHECK_DEDUP_ENV = "PERMITS_CHECK_DEDUP"
+
+# Full deduped dataset, Hive-partitioned by approval_year (approval_year=YYYY/)
+_PERMITS_DIR = _PROCESSED / "permits"
+
+# Hash of the inputs the current outputs were built from (see _input_stamp)
+_STAMP = _PROCESSED / "permits.stamp"
+
+# Aggregates a previous run must have left behind for transform() to skip
+_AGG_OUTPUTS = (
+    "permit_volume_monthly", "housing_units_by_year", "approval_timelines",
+    "solar_permits_monthly", "map_points", "top_permit_types",
+    "construction_by_zip", "bc_code_summary", "permit_summary",
+    "top_permit_types_precomputed", "sidebar_options",
+)
+
+# approval_type (uppercased, trimmed) LIKE pattern → approval_type_clean.
+# The first matching pattern wins; types matching none fall into 'Other'.
+_APPROVAL_TYPE_PATTERNS = (
+    ("%PHOTOVOLTAIC%", "Solar/PV"),
+    ("%PV%", "Solar/PV"),
+    ("%SOLAR%", "Solar/PV"),
+    ("%COMBINATION BUILDING%", "Building Permit"),
+    ("BUILDING PERMIT%", "Building Permit"),
+    ("%ELECTRICAL%", "Electrical"),
+    ("%PLUMBING%", "Plumbing"),
+    ("%MECHANICAL%", "Mechanical"),
+    ("%FIRE%", "Fire"),
+    ("%RIGHT OF WAY%", "Right of Way"),
+    ("%ROW%", "Right of Way"),
+    ("%SIGN%", "Sign"),
+)
+
+# Value sets of the low-cardinality label columns, declared as ENUMs so
+# GROUP BY and comparisons work on 1-byte codes (parquet still stores strings)
+_ENUM_TYPES = {
+    "approval_type_enum": (*dict.fromkeys(b for _, b in _APPROVAL_TYPE_PATTERNS), "Other"),
+    "source_system_enum": ("legacy", "current"),
+}
+
+# zip_code travels through the pipeline as a 2-byte USMALLINT offset from
+# _ZIP_BASE (91xxx / 92xxx → 1xxx / 2xxx); outputs format it back with _ZIP_CODE.
+_ZIP_BASE = 90000
+_ZIP_CODE = f"({_ZIP_BASE} + zip_offset)::VARCHAR"
+
+# Grouping keys of the aggregation cube, and the grouping set each aggregate
+# is sliced from (the *_days sets are (…, days) histograms for exact medians;
+# source_totals only feeds the per-source log line).
+_CUBE_KEYS = (
+    "approval_year", "approval_month", "approval_type_clean", "zip_offset",
+    "source_system", "bc_code", "bc_code_description", "approval_days",
+)
+_CUBE_SETS = {
+    "permit_volume_monthly": ("approval_year", "approval_month", "approval_type_clean", "source_system"),
+    "housing_units_by_year": ("approval_year",),
+    "approval_timelines": ("approval_year", "approval_type_clean", "zip_offset"),
+    "solar_permits_monthly": ("approval_year", "approval_month", "zip_offset"),
+    "top_permit_types": ("approval_type_clean",),
+    "top_permit_types_days": ("approval_type_clean", "approval_days"),
+    "construction_by_zip": ("zip_offset", "approval_year"),
+    "bc_code_summary": ("approval_year", "source_system", "bc_code", "bc_code_description"),
+    "permit_summary": ("approval_year", "approval_type_clean", "zip_offset", "source_system"),
+    "permit_summary_days": ("approval_year", "approval_type_clean", "zip_offset", "source_system", "approval_days"),
+    "source_totals": ("source_system",),
+}
+
+
+def _grouping_id(keys: tuple[str, ...]) -> int:
+    """GROUPING(*_CUBE_KEYS) value for a grouping set: one bit per key left out."""
+    n = len(_CUBE_KEYS)
+    return sum(1 << (n - 1 - i) for i, k in enumerate(_CUBE_KEYS) if k not in keys)
+
+
+def _csv_select(set_no: int) -> str:
+    """SELECT list projecting CSV set ``set_no`` onto permits columns."""
+    exprs = []
+    for csv_col, col, kind, sets in _CSV_COLUMNS:
+        if set_no not in sets:
+            continue
+        if kind == "id":
+            expr = csv_col
+        elif kind == "text":
+            expr = f"TRIM({csv_col})"
+        else:
+            expr = f"TRY_CAST({csv_col} AS {kind})"
+        exprs.append(f"{expr:<48} AS {col}")
+    return ",\n                ".join(exprs)
+
+
+def _csv_types(set_no: int) -> str:
+    """read_csv ``types`` struct declaring set ``set_no``'s id / text columns VARCHAR."""
+    return "{" + ", ".join(
+        f"'{csv_col}': 'VARCHAR'"
+        for csv_col, _, kind, sets in _CSV_COLUMNS
+        if set_no in sets and kind in ("id", "text")
+    ) + "}"
+
+
+def _input_stamp() -> str:
+    """Hash of each raw CSV's size + mtime and of this module's source."""
+    h = hashlib.sha256(Path(__file__).read_bytes())
+    for path in (_SET1_ACTIVE, _SET1_CLOSED, _SET2_ACTIVE, _SET2_CLOSED):
+        st = os.stat(path)
+        h.update(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def transform(force: bool = False) -> None:
+    """Run the full transform pipeline.
+
+    Skipped when the raw CSVs and this module are unchanged since the last
+    run and its outputs are still in place, unless ``force`` is set.
+    """
     _PROCESSED.mkdir(parents=True, exist_ok=True)
     _AGG.mkdir(parents=True, exist_ok=True)
 
-    con = duckdb.connect()
-
-    # ── Stage 1: Load & normalize Set 1 (legacy system, 39 cols) ──
-    print("  Loading Set 1 (legacy) ...")
-    con.execute(f"""
-        CREATE OR REPLACE TABLE set1_raw AS
-        SELECT * FROM read_csv(
-            ['{_SET1_ACTIVE}', '{_SET1_CLOSED}'],
-            union_by_name = true,
-            auto_detect = true,
-            ignore_errors = true
-        )
-    """)
-    row_count_1 = con.execute("SELECT COUNT(*) FROM set1_raw").fetchone()[0]
-    print(f"    Set 1 rows: {row_count_1:,}")
-
-    con.execute("""
-        CREATE OR REPLACE TABLE set1 AS
-        SELECT
-            CAST(APPROVAL_ID AS VARCHAR)        AS approval_id,
-            CAST(PROJECT_ID AS VARCHAR)         AS project_id,
-            CAST(DEVELOPMENT_ID AS VARCHAR)     AS development_id,
-            TRIM(PROJECT_TYPE)                  AS project_type,
-            TRIM(PROJECT_STATUS)                AS project_status,
-            TRIM(PROJECT_PROCESSING_CODE)       AS project_processing_code,
-            TRIM(PROJECT_TITLE)                 AS project_title,
-            TRIM(PROJECT_SCOPE)                 AS project_scope,
-            TRY_CAST(DATE_PROJECT_CREATE AS DATE)   AS date_project_create,
-            TRY_CAST(DATE_PROJECT_COMPLETE AS DATE) AS date_project_complete,
-            CAST(JOB_ID AS VARCHAR)             AS job_id,
-            TRIM(ADDRESS_JOB)                   AS address,
-            TRIM(CAST(JOB_APN AS VARCHAR))      AS apn,
-            TRIM(CAST(JOB_BC_CODE AS VARCHAR))  AS bc_code,
-            TRIM(JOB_BC_CODE_DESCRIPTION)       AS bc_code_description,
-            TRY_CAST(LAT_JOB AS DOUBLE)         AS lat,
-            TRY_CAST(LNG_JOB AS DOUBLE)         AS lng,
-            TRIM(APPROVAL_TYPE)                 AS approval_type,
-            TRIM(APPROVAL_STATUS)               AS approval_status,
-            TRIM(APPROVAL_SCOPE)                AS approval_scope,
-            TRY_CAST(DATE_APPROVAL_CREATE AS DATE)  AS date_approval_create,
-            TRY_CAST(DATE_APPROVAL_ISSUE AS DATE)   AS date_approval_issue,
-            TRY_CAST(DATE_APPROVAL_EXPIRE AS DATE)  AS date_approval_expire,
-            TRY_CAST(DATE_APPROVAL_CLOSE AS DATE)   AS date_approval_close,
-            TRY_CAST(APPROVAL_VALUATION AS DOUBLE)  AS valuation,
-            TRY_CAST(APPROVAL_DU_NET_CHANGE AS INTEGER) AS du_net_change,
-            TRY_CAST(APPROVAL_STORIES AS INTEGER)       AS stories,
-            TRY_CAST(APPROVAL_FLOOR_AREA AS DOUBLE)     AS floor_area,
-            TRY_CAST(APPROVAL_DU_EXTREMELY_LOW AS INTEGER)  AS du_extremely_low,
-            TRY_CAST(APPROVAL_DU_VERY_LOW AS INTEGER)       AS du_very_low,
-            TRY_CAST(APPROVAL_DU_LOW AS INTEGER)            AS du_low,
-            TRY_CAST(APPROVAL_DU_MODERATE AS INTEGER)       AS du_moderate,
-            TRY_CAST(APPROVAL_DU_ABOVE_MODERATE AS INTEGER) AS du_above_moderate,
-            TRY_CAST(APPROVAL_DU_FUTURE_DEMO AS INTEGER)    AS du_future_demo,
-            TRY_CAST(APPROVAL_DU_BONUS AS INTEGER)          AS du_bonus,
-            -- Set 1 has no ADU/JADU columns — NULL-fill
-            NULL::INTEGER AS adu_extremely_low,
-            NULL::INTEGER AS adu_very_low,
-            NULL::INTEGER AS adu_low,
-            NULL::INTEGER AS adu_moderate,
-            NULL::INTEGER AS adu_above_moderate,
-            NULL::INTEGER AS adu_bonus,
-            NULL::INTEGER AS adu_total,
-            NULL::INTEGER AS jadu_extremely_low,
-            NULL::INTEGER AS jadu_very_low,
-            NULL::INTEGER AS jadu_low,
-            NULL::INTEGER AS jadu_moderate,
-            NULL::INTEGER AS jadu_above_moderate,
-            NULL::INTEGER AS jadu_bonus,
-            NULL::INTEGER AS jadu_total,
-            TRIM(APPROVAL_PERMIT_HOLDER)        AS permit_holder,
-            'legacy'                            AS source_system
-        FROM set1_raw
-    """)
-
-    # ── Stage 2: Load & normalize Set 2 (current system, 46+ cols) ──
-    print("  Loading Set 2 (current) ...")
-    con.execute(f"""
-        CREATE OR REPLACE TABLE set2_raw AS
-        SELECT * FROM read_csv(
-            ['{_SET2_ACTIVE}', '{_SET2_CLOSED}'],
-            union_by_name = true,
-            auto_detect = true,
-            ignore_errors = true
-        )
-    """)
-    row_count_2 = con.execute("SELECT COUNT(*) FROM set2_raw").fetchone()[0]
-    print(f"    Set 2 rows: {row_count_2:,}")
-
-    con.execute("""
-        CREATE OR REPLACE TABLE set2 AS
-        SELECT
-            CAST(APPROVAL_ID AS VARCHAR)        AS approval_id,
-            CAST(PROJECT_ID AS VARCHAR)         AS project_id,
-            NULL::VARCHAR                       AS development_id,
-            NULL::VARCHAR                       AS project_type,
-            NULL::VARCHAR                       AS project_status,
-            TRIM(PROJECT_PROCESSING_CODE)       AS project_processing_code,
-            TRIM(PROJECT_TITLE)                 AS project_title,
-            TRIM(PROJECT_SCOPE)                 AS project_scope,
-            TRY_CAST(DATE_PROJECT_CREATE AS DATE)   AS date_project_create,
-            TRY_CAST(DATE_PROJECT_COMPLETE AS DATE) AS date_project_complete,
-            CAST(JOB_ID AS VARCHAR)             AS job_id,
-            TRIM(ADDRESS_JOB)                   AS address,
-            TRIM(CAST(JOB_APN AS VARCHAR))      AS apn,
-            TRIM(CAST(JOB_BC_CODE AS VARCHAR))  AS bc_code,
-            TRIM(JOB_BC_CODE_DESCRIPTION)       AS bc_code_description,
-            TRY_CAST(LAT_JOB AS DOUBLE)         AS lat,
-            TRY_CAST(LNG_JOB AS DOUBLE)         AS lng,
-            TRIM(APPROVAL_TYPE)                 AS approval_type,
-            TRIM(APPROVAL_STATUS)               AS approval_status,
-            TRIM(APPROVAL_SCOPE)                AS approval_scope,
-            TRY_CAST(DATE_APPROVAL_CREATE AS DATE)  AS date_approval_create,
-            TRY_CAST(DATE_APPROVAL_ISSUE AS DATE)   AS date_approval_issue,
-            TRY_CAST(DATE_APPROVAL_EXPIRE AS DATE)  AS date_approval_expire,
-            TRY_CAST(DATE_APPROVAL_CLOSE AS DATE)   AS date_approval_close,
-            TRY_CAST(APPROVAL_VALUATION AS DOUBLE)  AS valuation,
-            NULL::INTEGER                       AS du_net_change,
-            TRY_CAST(APPROVAL_STORIES AS INTEGER)       AS stories,
-            TRY_CAST(APPROVAL_FLOOR_AREA AS DOUBLE)     AS floor_area,
-            TRY_CAST(APPROVAL_DU_EXTREMELY_LOW AS INTEGER)  AS du_extremely_low,
-            TRY_CAST(APPROVAL_DU_VERY_LOW AS INTEGER)       AS du_very_low,
-            TRY_CAST(APPROVAL_DU_LOW AS INTEGER)            AS du_low,
-            TRY_CAST(APPROVAL_DU_MODERATE AS INTEGER)       AS du_moderate,
-            TRY_CAST(APPROVAL_DU_ABOVE_MODERATE AS INTEGER) AS du_above_moderate,
-            TRY_CAST(APPROVAL_DU_FUTURE_DEMO AS INTEGER)    AS du_future_demo,
-            TRY_CAST(APPROVAL_DU_BONUS AS INTEGER)          AS du_bonus,
-            TRY_CAST(APPROVAL_ADU_EXTREMELY_LOW AS INTEGER) AS adu_extremely_low,
-            TRY_CAST(APPROVAL_ADU_VERY_LOW AS INTEGER)      AS adu_very_low,
-            TRY_CAST(APPROVAL_ADU_LOW AS INTEGER)           AS adu_low,
-            TRY_CAST(APPROVAL_ADU_MODERATE AS INTEGER)      AS adu_moderate,
-            TRY_CAST(APPROVAL_ADU_ABOVE_MODERATE AS INTEGER) AS adu_above_moderate,
-            TRY_CAST(APPROVAL_ADU_BONUS AS INTEGER)         AS adu_bonus,
-            TRY_CAST(APPROVAL_ADU_TOTAL AS INTEGER)         AS adu_total,
-            TRY_CAST(APPROVAL_JADU_EXTREMELY_LOW AS INTEGER) AS jadu_extremely_low,
-            TRY_CAST(APPROVAL_JADU_VERY_LOW AS INTEGER)      AS jadu_very_low,
-            TRY_CAST(APPROVAL_JADU_LOW AS INTEGER)           AS jadu_low,
-            TRY_CAST(APPROVAL_JADU_MODERATE AS INTEGER)      AS jadu_moderate,
-            TRY_CAST(APPROVAL_JADU_ABOVE_MODERATE AS INTEGER) AS jadu_above_moderate,
-            TRY_CAST(APPROVAL_JADU_BONUS AS INTEGER)         AS jadu_bonus,
-            TRY_CAST(APPROVAL_JADU_TOTAL AS INTEGER)         AS jadu_total,
-            TRIM(APPROVAL_PERMIT_HOLDER)        AS permit_holder,
-            'current'                           AS source_system
-        FROM set2_raw
-    """)
+    stamp = _input_stamp()
+    if (
+        not force
+        and _STAMP.exists()
+        and _STAMP.read_text() == stamp
+        and _PERMITS_DIR.is_dir()
+        and all((_AGG / f"{name}.parquet").exists() for name in _AGG_OUTPUTS)
+    ):
+        print("  Inputs unchanged since the last transform, skipping (--force to rebuild)")
+        return
+    # Invalidate first so a run that fails partway is never mistaken for current
+    _STAMP.unlink(missing_ok=True)
 
-    # ── Stage 3: Union into single permits table with derived fields ──
-    print("  Unioning sets + deriving fields ...")
-    con.execute("""
-        CREATE OR REPLACE TABLE permits_union AS
-        SELECT * FROM set1
-        UNION ALL
-        SELECT * FROM set2
-    """)
-
-    total_raw = con.execute("SELECT COUNT(*) FROM permits_union").fetchone()[0]
-    print(f"    Union total: {total_raw:,}")
-
-    # Derived fields + dedup + geo filter
-    con.execute("""
-        CREATE OR REPLACE TABLE permits AS
-        WITH derived AS (
+    con = duckdb.connect()
+    # Pin parallelism and memory explicitly (the weekly runner shares the box),
+    # spill to disk beside the processed output instead of failing, and let
+    # DuckDB reorder vectors: every statement whose row order matters has its
+    # own ORDER BY, which this setting still honours.
+    con.execute(f"SET threads = {os.cpu_count() or 1}")
+    con.execute("SET memory_limit = '4GB'")
+    con.execute(f"SET temp_directory = '{_PROCESSED / '.duckdb_tmp'}'")
+    con.execute("SET preserve_insertion_order = false")
+    for name, values in _ENUM_TYPES.items():
+        labels = ", ".join(f"'{v}'" for v in values)
+        con.execute(f"CREATE TYPE {name} AS ENUM ({labels})")
+
+    # ── Load, normalize, union & derive in one pass ──
+    # Each set's CSVs are cast/trimmed straight off read_csv and unioned
+    # inside the CTE, so DuckDB streams CSV → cast → union → filter → derive →
+    # dedup without materializing raw, per-set, or union tables in between.
+    print("  Loading Set 1 (legacy) + Set 2 (current), deriving fields ...")
+    type_map = ", ".join(
+        f"('{pattern}', '{bucket}', {priority})"
+        for priority, (pattern, bucket) in enumerate(_APPROVAL_TYPE_PATTERNS)
+    )
+    load_ctes = f"""
+        WITH set1 AS (
+            -- Set 1: legacy system, 39 cols
+            SELECT
+                {_csv_select(1)},
+                'legacy'::source_system_enum        AS source_system
+            FROM read_csv(
+                ['{_SET1_ACTIVE}', '{_SET1_CLOSED}'],
+                types = {_csv_types(1)},
+                union_by_name = true,
+                auto_detect = true,
+                ignore_errors = true
+            )
+        ),
+        set2 AS (
+            -- Set 2: current system, 46+ cols
+            SELECT
+                {_csv_select(2)},
+                'current'::source_system_enum       AS source_system
+            FROM read_csv(
+                ['{_SET2_ACTIVE}', '{_SET2_CLOSED}'],
+                types = {_csv_types(2)},
+                union_by_name = true,
+                auto_detect = true,
+                ignore_errors = true
+            )
+        ),
+        permits_union AS (
+            -- BY NAME: columns one set lacks (Set 1 ADU/JADU; Set 2 development,
+            -- project type/status, du_net_change) come through as NULL
+            SELECT * FROM set1
+            UNION ALL BY NAME
+            SELECT * FROM set2
+        ),
+        -- string work done once per row, reused by every CASE below
+        normalized AS (
             SELECT
                 *,
+                UPPER(TRIM(approval_type))                  AS _at_u,
+                REGEXP_EXTRACT(address, '9[12][0-9]{{3}}')  AS _zip_raw
+            FROM permits_union
+            -- geo filter: San Diego bounds, applied per source record so
+            -- out-of-region rows never reach derive or the dedup sort
+            WHERE (lat IS NULL OR (lat BETWEEN 32.5 AND 33.3))
+              AND (lng IS NULL OR (lng BETWEEN -117.7 AND -116.8))
+        ),
+        approval_type_map (pattern, bucket, priority) AS (
+            VALUES {type_map}
+        ),
+        -- classify each distinct type once, then hash-join back onto the rows
+        type_buckets AS (
+            SELECT t._at_u AS _bucket_key, ARG_MIN(m.bucket, m.priority) AS _bucket
+            FROM (SELECT DISTINCT _at_u FROM normalized WHERE _at_u IS NOT NULL) t
+            JOIN approval_type_map m ON t._at_u LIKE m.pattern
+            GROUP BY t._at_u
+        ),
+        derived AS (
+            SELECT
+                normalized.*,
                 -- zip code from address (only keep valid SD zips: 920xx-921xx)
-                CASE
-                    WHEN REGEXP_EXTRACT(address, '(9[12][0-9]{3})', 1) != ''
-                    THEN REGEXP_EXTRACT(address, '(9[12][0-9]{3})', 1)
-                    ELSE NULL
-                END AS zip_code,
+                CASE WHEN LENGTH(_zip_raw) = 5
+                     THEN (_zip_raw::INTEGER - {_ZIP_BASE})::USMALLINT
+                END AS zip_offset,
 
                 -- approval timeline
                 CASE
@@ -209,36 +313,13 @@ def transform() -> None:
                 MONTH(COALESCE(date_approval_issue, date_approval_create)) AS approval_month,
 
                 -- approval type clean (normalized grouping)
-                CASE
-                    WHEN UPPER(TRIM(approval_type)) LIKE '%PHOTOVOLTAIC%'
-                      OR UPPER(TRIM(approval_type)) LIKE '%PV%'
-                      OR UPPER(TRIM(approval_type)) LIKE '%SOLAR%'
-                    THEN 'Solar/PV'
-                    WHEN UPPER(TRIM(approval_type)) LIKE '%COMBINATION BUILDING%'
-                      OR UPPER(TRIM(approval_type)) = 'BUILDING PERMIT'
-                      OR UPPER(TRIM(approval_type)) LIKE 'BUILDING PERMIT%'
-                    THEN 'Building Permit'
-                    WHEN UPPER(TRIM(approval_type)) LIKE '%ELECTRICAL%'
-                    THEN 'Electrical'
-                    WHEN UPPER(TRIM(approval_type)) LIKE '%PLUMBING%'
-                    THEN 'Plumbing'
-                    WHEN UPPER(TRIM(approval_type)) LIKE '%MECHANICAL%'
-                    THEN 'Mechanical'
-                    WHEN UPPER(TRIM(approval_type)) LIKE '%FIRE%'
-                    THEN 'Fire'
-                    WHEN UPPER(TRIM(approval_type)) LIKE '%RIGHT OF WAY%'
-                      OR UPPER(TRIM(approval_type)) LIKE '%ROW%'
-                    THEN 'Right of Way'
-                    WHEN UPPER(TRIM(approval_type)) LIKE '%SIGN%'
-                    THEN 'Sign'
-                    ELSE 'Other'
-                END AS approval_type_clean,
+                COALESCE(_bucket, 'Other')::approval_type_enum AS approval_type_clean,
 
                 -- is_housing: bc_code starts with '10' (new residential) OR building permit with DU > 0
                 CASE
                     WHEN bc_code IS NOT NULL AND bc_code LIKE '10%' THEN TRUE
-                    WHEN (UPPER(TRIM(approval_type)) LIKE '%BUILDING PERMIT%'
-                          OR UPPER(TRIM(approval_type)) LIKE '%COMBINATION BUILDING%')
+                    WHEN (_at_u LIKE '%BUILDING PERMIT%'
+                          OR _at_u LIKE '%COMBINATION BUILDING%')
                          AND (COALESCE(du_extremely_low, 0) + COALESCE(du_very_low, 0)
                               + COALESCE(du_low, 0) + COALESCE(du_moderate, 0)
                               + COALESCE(du_above_moderate, 0)
@@ -249,9 +330,9 @@ def transform() -> None:
 
                 -- is_solar
                 CASE
-                    WHEN UPPER(TRIM(approval_type)) LIKE '%PHOTOVOLTAIC%'
-                      OR UPPER(TRIM(approval_type)) LIKE '%PV%'
-                      OR UPPER(TRIM(approval_type)) LIKE '%SOLAR%'
+                    WHEN _at_u LIKE '%PHOTOVOLTAIC%'
+                      OR _at_u LIKE '%PV%'
+                      OR _at_u LIKE '%SOLAR%'
                     THEN TRUE
                     ELSE FALSE
                 END AS is_solar,
@@ -271,225 +352,470 @@ def transform() -> None:
                 + COALESCE(du_future_demo, 0) + COALESCE(du_bonus, 0)
                 + COALESCE(adu_total, 0) + COALESCE(jadu_total, 0)
                 AS total_du
-            FROM permits_union
-        ),
-        deduped AS (
-            SELECT *,
-                ROW_NUMBER() OVER (
-                    PARTITION BY approval_id
-                    ORDER BY date_approval_close DESC NULLS LAST
-                ) AS _rn
-            FROM derived
+            FROM normalized
+            LEFT JOIN type_buckets ON _bucket_key = _at_u
         )
-        SELECT * EXCLUDE (_rn)
-        FROM deduped
-        WHERE _rn = 1
-          -- geo filter: San Diego bounds
-          AND (lat IS NULL OR (lat BETWEEN 32.5 AND 33.3))
-          AND (lng IS NULL OR (lng BETWEEN -117.7 AND -116.8))
+    """
+    # Dedup: one row per approval_id, keeping the most recent close date; ties
+    # go to the current system. The second sort key also keeps DuckDB 1.5's
+    # top_n_window_elimination off this query: it rewrites a single-key
+    # ROW_NUMBER() = 1 into arg_max_nulls_last, which keeps a stale row for
+    # some approvals when run multi-threaded.
+    con.execute(f"""
+        CREATE OR REPLACE TABLE permits AS
+        {load_ctes}
+        SELECT * EXCLUDE (_at_u, _zip_raw)
+        FROM derived
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY approval_id
+            ORDER BY date_approval_close DESC NULLS LAST, source_system DESC
+        ) = 1
     """)
-
-    final_count = con.execute("SELECT COUNT(*) FROM permits").fetchone()[0]
-    print(f"    Final permits (deduped + geo-filtered): {final_count:,}")
+    if os.environ.get(_CHECK_DEDUP_ENV):
+        _check_dedup(con, load_ctes)
 
     # ── Export main parquet ──
-    print(f"  Exporting {_PERMITS_PARQUET} ...")
+    print(f"  Exporting {_PERMITS_DIR} ...")
+    # Clear the previous run so partitions for years no longer present don't linger
+    shutil.rmtree(_PERMITS_DIR, ignore_errors=True)
+    # COPY reports the rows it wrote, so the final count needs no extra scan
+    (final_count,) = con.execute(f"""
+        COPY permits TO '{_PERMITS_DIR}'
+        (FORMAT PARQUET, CODEC 'ZSTD', PARTITION_BY (approval_year))
+    """).fetchone()
+    print(f"    Final permits (geo-filtered + deduped): {final_count:,}")
+
+    # Re-point `permits` at the exported parquet so each aggregation reads only
+    # the column chunks (and year partitions) it references, and the in-memory
+    # table is freed. Parquet stores the ENUM columns as strings; cast back.
+    con.execute("DROP TABLE permits")
     con.execute(f"""
-        COPY permits TO '{_PERMITS_PARQUET}'
-        (FORMAT PARQUET, CODEC 'ZSTD')
+        CREATE VIEW permits AS
+        SELECT * REPLACE (
+            approval_type_clean::approval_type_enum AS approval_type_clean,
+            source_system::source_system_enum AS source_system
+        )
+        FROM read_parquet('{_PERMITS_DIR}/**/*.parquet', hive_partitioning = true)
     """)
-    size_mb = Path(_PERMITS_PARQUET).stat().st_size / (1024 * 1024)
-    print(f"    permits.parquet: {size_mb:.1f} MB")
 
     # ── Build aggregations ──
     _build_aggregations(con)
 
     con.close()
+    _STAMP.write_text(stamp)
     print("  Transform complete.")
 
 
+def _check_dedup(con: duckdb.DuckDBPyConnection, load_ctes: str) -> None:
+    """Raise if any deduped permit is not its approval's latest source record.
+
+    Debug-only: re-reads the source CSVs through ``load_ctes``.
+    """
+    (wrong_picks,) = con.execute(f"""
+        {load_ctes}
+        SELECT COUNT(*)
+        FROM permits p
+        JOIN (
+            SELECT approval_id, MAX(date_approval_close) AS latest_close
+            FROM normalized
+            GROUP BY approval_id
+        ) m USING (approval_id)
+        WHERE p.date_approval_close IS DISTINCT FROM m.latest_close
+    """).fetchone()
+    if wrong_picks:
+        raise RuntimeError(
+            f"Dedup kept a stale record for {wrong_picks:,} approvals "
+            "(winner is not the latest date_approval_close)"
+        )
+    print("    Dedup check: every approval kept its latest record")
+
+
+def _run_step(con: duckdb.DuckDBPyConnection, name: str, sql: str) -> None:
+    """Run one aggregation statement, writing its profile to <name>.json when profiling."""
+    print(f"  Aggregating: {name} ...")
+    profile_dir = os.environ.get(_PROFILE_ENV)
+    if profile_dir:
+        out = str(Path(profile_dir) / f"{name}.json").replace("'", "''")
+        con.execute(f"PRAGMA profiling_output = '{out}'")
+    con.execute(sql)
+
+
+def _run_helper(con: duckdb.DuckDBPyConnection, sql: str) -> list[tuple]:
+    """Run a bookkeeping statement with profiling off, so it can't overwrite a step's profile."""
+    profiling = bool(os.environ.get(_PROFILE_ENV))
+    if profiling:
+        con.execute("PRAGMA disable_profiling")
+    try:
+        return con.execute(sql).fetchall()
+    finally:
+        if profiling:
+            con.execute("PRAGMA enable_profiling = 'json'")
+
+
 def _build_aggregations(con: duckdb.DuckDBPyConnection) -> None:
-    """Build 8 pre-aggregated parquet files for dashboard/API."""
+    """Build 11 pre-aggregated parquet files for dashboard/API."""
+    profile_dir = os.environ.get(_PROFILE_ENV)
+    if profile_dir:
+        Path(profile_dir).mkdir(parents=True, exist_ok=True)
+        con.execute("PRAGMA enable_profiling = 'json'")
+
+    # Every aggregate except map_points (5) groups the same permits rows on
+    # subsets of the same keys, so compute all of their grouping sets in one
+    # scan into _agg_cube and slice each parquet out of it by GROUPING().
+    # Per-aggregate filters (is_housing, is_solar, approval_days) become
+    # FILTERed / NULL-skipping aggregates; NOT NULL key filters move to the
+    # slices.
+    g = {name: _grouping_id(keys) for name, keys in _CUBE_SETS.items()}
+    grouping_sets = ",\n                ".join(
+        f"({', '.join(keys)})" for keys in _CUBE_SETS.values()
+    )
+    _run_step(con, "_agg_cube", f"""
+        CREATE OR REPLACE TEMP TABLE _agg_cube AS
+        SELECT
+            {', '.join(_CUBE_KEYS)},
+            COUNT(*) AS permit_count,
+            SUM(total_du) AS total_du,
+            SUM(COALESCE(valuation, 0))::BIGINT AS total_valuation,
+            AVG(valuation)::BIGINT AS avg_valuation,
+            COUNT(approval_days) AS count_with_days,
+            SUM(approval_days) AS sum_approval_days,
+            AVG(approval_days)::INTEGER AS avg_days,
+            COUNT(*) FILTER (WHERE is_solar = TRUE) AS solar_count,
+            COUNT(*) FILTER (WHERE is_housing = TRUE) AS housing_count,
+            SUM(COALESCE(du_extremely_low, 0))  FILTER (WHERE is_housing = TRUE) AS du_extremely_low,
+            SUM(COALESCE(du_very_low, 0))       FILTER (WHERE is_housing = TRUE) AS du_very_low,
+            SUM(COALESCE(du_low, 0))            FILTER (WHERE is_housing = TRUE) AS du_low,
+            SUM(COALESCE(du_moderate, 0))       FILTER (WHERE is_housing = TRUE) AS du_moderate,
+            SUM(COALESCE(du_above_moderate, 0)) FILTER (WHERE is_housing = TRUE) AS du_above_moderate,
+            SUM(COALESCE(adu_total, 0))         FILTER (WHERE is_housing = TRUE) AS adu_total,
+            SUM(COALESCE(jadu_total, 0))        FILTER (WHERE is_housing = TRUE) AS jadu_total,
+            SUM(total_du)                       FILTER (WHERE is_housing = TRUE) AS housing_du,
+            GROUPING({', '.join(_CUBE_KEYS)}) AS g
+        FROM permits
+        GROUP BY GROUPING SETS (
+                {grouping_sets}
+        )
+    """)
+
+    by_source = dict(_run_helper(con, f"""
+        SELECT source_system, permit_count FROM _agg_cube WHERE g = {g['source_totals']}
+    """))
+    print(f"    Permits by source: legacy {by_source.get('legacy', 0):,}, current {by_source.get('current', 0):,}")
 
     # 1. permit_volume_monthly — monthly counts by approval_type_clean, source_system
-    print("  Aggregating: permit_volume_monthly ...")
-    con.execute(f"""
+    _run_step(con, "permit_volume_monthly", f"""
         COPY (
             SELECT
                 approval_year AS year,
                 approval_month AS month,
                 approval_type_clean,
                 source_system,
-                COUNT(*) AS permit_count
-            FROM permits
-            WHERE approval_year IS NOT NULL
-            GROUP BY approval_year, approval_month, approval_type_clean, source_system
+                permit_count
+            FROM _agg_cube
+            WHERE g = {g['permit_volume_monthly']} AND approval_year IS NOT NULL
             ORDER BY year, month
         ) TO '{_AGG}/permit_volume_monthly.parquet'
         (FORMAT PARQUET, CODEC 'ZSTD')
     """)
 
     # 2. housing_units_by_year — annual DU counts by income category
-    print("  Aggregating: housing_units_by_year ...")
-    con.execute(f"""
+    _run_step(con, "housing_units_by_year", f"""
         COPY (
             SELECT
                 approval_year AS year,
-                SUM(COALESCE(du_extremely_low, 0)) AS du_extremely_low,
-                SUM(COALESCE(du_very_low, 0))      AS du_very_low,
-                SUM(COALESCE(du_low, 0))            AS du_low,
-                SUM(COALESCE(du_moderate, 0))       AS du_moderate,
-                SUM(COALESCE(du_above_moderate, 0)) AS du_above_moderate,
-                SUM(COALESCE(adu_total, 0))         AS adu_total,
-                SUM(COALESCE(jadu_total, 0))        AS jadu_total,
-                SUM(total_du)                       AS total_du
-            FROM permits
-            WHERE approval_year IS NOT NULL AND is_housing = TRUE
-            GROUP BY approval_year
+                du_extremely_low,
+                du_very_low,
+                du_low,
+                du_moderate,
+                du_above_moderate,
+                adu_total,
+                jadu_total,
+                housing_du AS total_du
+            FROM _agg_cube
+            WHERE g = {g['housing_units_by_year']}
+              AND approval_year IS NOT NULL AND housing_count > 0
             ORDER BY year
         ) TO '{_AGG}/housing_units_by_year.parquet'
         (FORMAT PARQUET, CODEC 'ZSTD')
     """)
 
     # 3. approval_timelines — median/avg/p90 approval_days by type, zip, year
-    print("  Aggregating: approval_timelines ...")
-    con.execute(f"""
+    #    (median/p90 from one approx_quantile sketch per group, read off permits)
+    _run_step(con, "approval_timelines", f"""
         COPY (
+            WITH days_q AS (
+                SELECT
+                    approval_year, approval_type_clean, {_ZIP_CODE} AS zip_code,
+                    approx_quantile(approval_days, [0.5, 0.9]) AS q
+                FROM permits
+                WHERE approval_year IS NOT NULL AND approval_days IS NOT NULL
+                GROUP BY approval_year, approval_type_clean, zip_offset
+            ),
+            timelines AS (
+                SELECT
+                    approval_year AS year,
+                    approval_type_clean,
+                    {_ZIP_CODE} AS zip_code,
+                    count_with_days AS permit_count,
+                    avg_days
+                FROM _agg_cube
+                WHERE g = {g['approval_timelines']}
+                  AND approval_year IS NOT NULL AND count_with_days > 0
+            )
             SELECT
-                approval_year AS year,
-                approval_type_clean,
-                zip_code,
-                COUNT(*) AS permit_count,
-                MEDIAN(approval_days) AS median_days,
-                AVG(approval_days)::INTEGER AS avg_days,
-                QUANTILE_CONT(approval_days, 0.9)::INTEGER AS p90_days
-            FROM permits
-            WHERE approval_days IS NOT NULL AND approval_year IS NOT NULL
-            GROUP BY approval_year, approval_type_clean, zip_code
-            ORDER BY year, approval_type_clean
+                t.year,
+                t.approval_type_clean,
+                t.zip_code,
+                t.permit_count,
+                q.q[1]::INTEGER AS median_days,
+                t.avg_days,
+                q.q[2]::INTEGER AS p90_days
+            FROM timelines t
+            LEFT JOIN days_q q
+              ON t.year = q.approval_year
+             AND t.approval_type_clean = q.approval_type_clean
+             AND t.zip_code IS NOT DISTINCT FROM q.zip_code
+            ORDER BY t.year, t.approval_type_clean
         ) TO '{_AGG}/approval_timelines.parquet'
         (FORMAT PARQUET, CODEC 'ZSTD')
     """)
 
-    # 4. solar_permits_monthly — monthly PV counts + cumulative
-    print("  Aggregating: solar_permits_monthly ...")
-    con.execute(f"""
+    # 4. solar_permits_monthly — monthly PV counts + per-zip cumulative
+    #    (one row per zip × month, so a ROWS frame skips RANGE peer handling)
+    _run_step(con, "solar_permits_monthly", f"""
         COPY (
             SELECT
-                year, month, zip_code, permit_count,
-                SUM(permit_count) OVER (PARTITION BY zip_code ORDER BY year, month) AS cumulative_total
-            FROM (
-                SELECT
-                    approval_year AS year,
-                    approval_month AS month,
-                    zip_code,
-                    COUNT(*) AS permit_count
-                FROM permits
-                WHERE is_solar = TRUE AND approval_year IS NOT NULL
-                GROUP BY approval_year, approval_month, zip_code
-            )
+                approval_year AS year,
+                approval_month AS month,
+                {_ZIP_CODE} AS zip_code,
+                solar_count AS permit_count,
+                SUM(solar_count) OVER (
+                    PARTITION BY zip_offset ORDER BY approval_year, approval_month
+                    ROWS UNBOUNDED PRECEDING
+                ) AS cumulative_total
+            FROM _agg_cube
+            WHERE g = {g['solar_permits_monthly']}
+              AND approval_year IS NOT NULL AND solar_count > 0
             ORDER BY year, month
         ) TO '{_AGG}/solar_permits_monthly.parquet'
         (FORMAT PARQUET, CODEC 'ZSTD')
     """)
 
-    # 5. map_points — full geo dataset for mapping
-    print("  Aggregating: map_points ...")
-    con.execute(f"""
+    # 5. map_points — full geo dataset for mapping, sorted so row-group
+    #    min/max stats prune on the year / zip filters (122,880-row groups
+    #    matching DuckDB's own, ~2-5 years each). The largest aggregate, so
+    #    lat/lng drop to FLOAT (~1 m at SD's latitude, far below a map pixel)
+    #    and it gets a higher ZSTD level.
+    _run_step(con, "map_points", f"""
         COPY (
             SELECT
-                lat, lng,
+                lat::FLOAT AS lat,
+                lng::FLOAT AS lng,
                 approval_type_clean,
                 approval_year,
                 valuation,
                 total_du,
                 is_housing,
                 is_solar,
-                zip_code
+                {_ZIP_CODE} AS zip_code
             FROM permits
             WHERE lat IS NOT NULL AND lng IS NOT NULL
+            ORDER BY approval_year, zip_offset
         ) TO '{_AGG}/map_points.parquet'
-        (FORMAT PARQUET, CODEC 'ZSTD')
+        (FORMAT PARQUET, CODEC 'ZSTD', COMPRESSION_LEVEL 9, ROW_GROUP_SIZE 122880)
     """)
 
-    # 6. top_permit_types — summary stats per approval_type
-    print("  Aggregating: top_permit_types ...")
-    con.execute(f"""
+    # 6. top_permit_types — summary stats per approval_type, with the exact
+    #    median taken from the type × approval_days histogram
+    _run_step(con, "top_permit_types", f"""
         COPY (
+            WITH days_median AS (
+                SELECT
+                    approval_type_clean,
+                    (MIN(approval_days) FILTER (WHERE cum >= (tot + 1) // 2)
+                     + MIN(approval_days) FILTER (WHERE cum >= tot // 2 + 1)) / 2
+                        AS median_approval_days
+                FROM (
+                    SELECT
+                        approval_type_clean,
+                        approval_days,
+                        SUM(permit_count) OVER (
+                            PARTITION BY approval_type_clean ORDER BY approval_days
+                        ) AS cum,
+                        SUM(permit_count) OVER (PARTITION BY approval_type_clean) AS tot
+                    FROM _agg_cube
+                    WHERE g = {g['top_permit_types_days']} AND approval_days IS NOT NULL
+                )
+                GROUP BY approval_type_clean
+            )
             SELECT
                 approval_type_clean,
-                COUNT(*) AS permit_count,
-                AVG(valuation)::BIGINT AS avg_valuation,
-                MEDIAN(approval_days) AS median_approval_days
-            FROM permits
-            GROUP BY approval_type_clean
+                permit_count,
+                avg_valuation,
+                m.median_approval_days
+            FROM _agg_cube
+            LEFT JOIN days_median m USING (approval_type_clean)
+            WHERE g = {g['top_permit_types']}
             ORDER BY permit_count DESC
         ) TO '{_AGG}/top_permit_types.parquet'
         (FORMAT PARQUET, CODEC 'ZSTD')
     """)
 
     # 7. construction_by_zip — permits, valuation, DUs by zip and year
-    print("  Aggregating: construction_by_zip ...")
-    con.execute(f"""
+    _run_step(con, "construction_by_zip", f"""
         COPY (
             SELECT
-                zip_code,
+                {_ZIP_CODE} AS zip_code,
                 approval_year AS year,
-                COUNT(*) AS permit_count,
-                SUM(COALESCE(valuation, 0))::BIGINT AS total_valuation,
-                SUM(total_du) AS total_du
-            FROM permits
-            WHERE zip_code IS NOT NULL AND approval_year IS NOT NULL
-            GROUP BY zip_code, approval_year
-            ORDER BY zip_code, year
+                permit_count,
+                total_valuation,
+                total_du
+            FROM _agg_cube
+            WHERE g = {g['construction_by_zip']}
+              AND zip_offset IS NOT NULL AND approval_year IS NOT NULL
+            ORDER BY zip_offset, year
         ) TO '{_AGG}/construction_by_zip.parquet'
         (FORMAT PARQUET, CODEC 'ZSTD')
     """)
 
     # 8. bc_code_summary — building type breakdown (with year + source for filtering)
-    print("  Aggregating: bc_code_summary ...")
-    con.execute(f"""
+    _run_step(con, "bc_code_summary", f"""
         COPY (
             SELECT
                 approval_year AS year,
                 source_system,
                 bc_code,
                 bc_code_description,
-                COUNT(*) AS permit_count,
-                SUM(total_du) AS total_du,
-                SUM(COALESCE(valuation, 0))::BIGINT AS total_valuation
-            FROM permits
-            WHERE bc_code IS NOT NULL AND approval_year IS NOT NULL
-            GROUP BY approval_year, source_system, bc_code, bc_code_description
+                permit_count,
+                total_du,
+                total_valuation
+            FROM _agg_cube
+            WHERE g = {g['bc_code_summary']}
+              AND bc_code IS NOT NULL AND approval_year IS NOT NULL
             ORDER BY permit_count DESC
         ) TO '{_AGG}/bc_code_summary.parquet'
         (FORMAT PARQUET, CODEC 'ZSTD')
     """)
 
     # 9. permit_summary — overview-level stats by year/type/zip/source
-    #    Replaces direct queries against the full permits.parquet
-    print("  Aggregating: permit_summary ...")
-    con.execute(f"""
+    #    Replaces direct queries against the full permits dataset.
+    #    approval_days_hist holds (days, n) pairs so the API can compute exact
+    #    medians across groups instead of averaging group medians; the group
+    #    median itself is an approx_quantile read off permits.
+    _run_step(con, "permit_summary", f"""
         COPY (
-            SELECT
-                approval_year AS year,
-                approval_type_clean,
-                zip_code,
-                source_system,
-                COUNT(*) AS permit_count,
-                SUM(total_du) AS total_du,
-                SUM(COALESCE(valuation, 0))::BIGINT AS total_valuation,
-                COUNT(approval_days) AS count_with_days,
-                SUM(approval_days) AS sum_approval_days,
-                MEDIAN(approval_days) AS median_approval_days
-            FROM permits
-            WHERE approval_year IS NOT NULL
-            GROUP BY approval_year, approval_type_clean, zip_code, source_system
-            ORDER BY year
+            WITH days_q AS (
+                SELECT
+                    approval_year, approval_type_clean, {_ZIP_CODE} AS zip_code, source_system,
+                    approx_quantile(approval_days, 0.5)::INTEGER AS median_approval_days
+                FROM permits
+                WHERE approval_year IS NOT NULL AND approval_days IS NOT NULL
+                GROUP BY approval_year, approval_type_clean, zip_offset, source_system
+            ),
+            days_hist AS (
+                SELECT
+                    approval_year, approval_type_clean, {_ZIP_CODE} AS zip_code, source_system,
+                    LIST({{'days': approval_days, 'n': permit_count}} ORDER BY approval_days) AS approval_days_hist
+                FROM _agg_cube
+                WHERE g = {g['permit_summary_days']}
+                  AND approval_year IS NOT NULL AND approval_days IS NOT NULL
+                GROUP BY approval_year, approval_type_clean, zip_offset, source_system
+            ),
+            summary AS (
+                SELECT
+                    approval_year AS year,
+                    approval_type_clean,
+                    {_ZIP_CODE} AS zip_code,
+                    source_system,
+                    permit_count,
+                    total_du,
+                    total_valuation,
+                    count_with_days,
+                    sum_approval_days
+                FROM _agg_cube
+                WHERE g = {g['permit_summary']} AND approval_year IS NOT NULL
+            )
+            SELECT s.*, q.median_approval_days, h.approval_days_hist
+            FROM summary s
+            LEFT JOIN days_q q
+              ON s.year = q.approval_year
+             AND s.approval_type_clean = q.approval_type_clean
+             AND s.zip_code IS NOT DISTINCT FROM q.zip_code
+             AND s.source_system = q.source_system
+            LEFT JOIN days_hist h
+              ON s.year = h.approval_year
+             AND s.approval_type_clean = h.approval_type_clean
+             AND s.zip_code IS NOT DISTINCT FROM h.zip_code
+             AND s.source_system = h.source_system
+            ORDER BY s.year
         ) TO '{_AGG}/permit_summary.parquet'
         (FORMAT PARQUET, CODEC 'ZSTD')
     """)
+    _run_helper(con, "DROP TABLE _agg_cube")
+
+    # 10. top_permit_types_precomputed — permit_summary rolled up to year × type
+    #     so the top-types endpoint only filters by year and sums a few rows.
+    #     median_approval_days stays the count-weighted mean of group medians
+    #     (unrounded), so re-weighting across years reproduces permit_summary;
+    #     approval_days_hist is the merged histogram for exact medians.
+    _run_step(con, "top_permit_types_precomputed", f"""
+        COPY (
+            WITH days_hist AS (
+                SELECT
+                    year, approval_type_clean,
+                    LIST({{'days': days, 'n': n}} ORDER BY days) AS approval_days_hist
+                FROM (
+                    SELECT year, approval_type_clean, days, SUM(n)::BIGINT AS n
+                    FROM (
+                        SELECT year, approval_type_clean,
+                               UNNEST(approval_days_hist, recursive := true)
+                        FROM read_parquet('{_AGG}/permit_summary.parquet')
+                    )
+                    GROUP BY year, approval_type_clean, days
+                )
+                GROUP BY year, approval_type_clean
+            ),
+            summary AS (
+                SELECT
+                    year,
+                    approval_type_clean,
+                    SUM(permit_count)::BIGINT AS permit_count,
+                    SUM(total_valuation)::BIGINT AS total_valuation,
+                    SUM(count_with_days)::BIGINT AS count_with_days,
+                    SUM(median_approval_days * count_with_days)
+                        / NULLIF(SUM(count_with_days), 0) AS median_approval_days
+                FROM read_parquet('{_AGG}/permit_summary.parquet')
+                GROUP BY year, approval_type_clean
+            )
+            SELECT s.*, h.approval_days_hist
+            FROM summary s
+            LEFT JOIN days_hist h USING (year, approval_type_clean)
+            ORDER BY year, approval_type_clean
+        ) TO '{_AGG}/top_permit_types_precomputed.parquet'
+        (FORMAT PARQUET, CODEC 'ZSTD')
+    """)
+
+    # 11. sidebar_options — the dashboard's year / type / zip filter lists as one
+    #     row of sorted list columns, read from the aggregates they filter.
+    _run_step(con, "sidebar_options", f"""
+        COPY (
+            SELECT
+                (SELECT LIST(DISTINCT year ORDER BY year)
+                 FROM read_parquet('{_AGG}/permit_volume_monthly.parquet')
+                 WHERE year IS NOT NULL) AS years,
+                (SELECT LIST(DISTINCT approval_type_clean ORDER BY approval_type_clean)
+                 FROM read_parquet('{_AGG}/top_permit_types.parquet')
+                 WHERE approval_type_clean IS NOT NULL) AS types,
+                (SELECT LIST(DISTINCT CAST(zip_code AS VARCHAR) ORDER BY CAST(zip_code AS VARCHAR))
+                 FROM read_parquet('{_AGG}/construction_by_zip.parquet')
+                 WHERE zip_code IS NOT NULL) AS zips
+        ) TO '{_AGG}/sidebar_options.parquet'
+        (FORMAT PARQUET, CODEC 'ZSTD')
+    """)
 
+    if profile_dir:
+        con.execute("PRAGMA disable_profiling")
+        print(f"  Per-step query profiles written to {profile_dir}/")
     print("  All aggregations complete.")
 
 